@@ -100,3 +100,36 @@ class Decoder(tf.keras.Model):
         x = self.fc(output)
 
         return x, state, attention_weights  # 输出预测结果，当前状态和权重
+
+# 贪心解码
+def greedy_decode(encoder: Encoder, decoder: Decoder, inputs: tf.Tensor, bos_id: int, eos_id: int,
+                  max_length: int) -> typing.Tuple[typing.List[int], typing.List[float]]:
+    '''
+    encoder: 编码器
+    decoder: 解码器
+    inputs: 已转换为id并填充的输入，形状为[1, 句子长度]
+    bos_id: 开始标记的id
+    eos_id: 结束标记的id
+    max_length: 最大输出长度
+    返回预测出的id列表（不含结束标记）和每个id的对数概率
+    '''
+    # 编码
+    enc_out, enc_hidden = encoder(inputs)
+    dec_hidden = enc_hidden
+    dec_input = tf.expand_dims([bos_id], 0)
+    predicted_ids = []
+    log_probs = []
+
+    for t in range(max_length):
+        # 解码
+        predictions, dec_hidden, attention_weights = decoder(dec_input, dec_hidden, enc_out)
+        log_softmax = tf.nn.log_softmax(predictions[0])
+        # 预测出词语对应的id，遇到结束标记停止输出
+        predicted_id = int(tf.argmax(log_softmax).numpy())
+        if predicted_id == eos_id:
+            break
+        predicted_ids.append(predicted_id)
+        log_probs.append(float(log_softmax[predicted_id].numpy()))
+        dec_input = tf.expand_dims([predicted_id], 0)
+
+    return predicted_ids, log_probs
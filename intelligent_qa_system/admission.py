@@ -0,0 +1,371 @@
+"""
+请求准入控制
+按客户端的令牌桶限流、按优先级排队执行（交互式请求优先于批量请求），
+排队过长时直接返回429，并统计排队等待时间；
+令牌桶可保存在共享内存中，使多个工作进程共享同一组限额
+"""
+import fcntl
+import functools
+import heapq
+import itertools
+import os
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+# 优先级：数值越小越优先
+PRIORITIES = {'interactive': 0, 'bulk': 1}
+
+
+class MemoryBucketBackend:
+    """进程内令牌桶，客户端数超过上限时淘汰最久未访问的桶"""
+
+    def __init__(self, max_clients=10000):
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key, rate, burst, cost=1.0):
+        '''
+        从key对应的桶中取出cost个令牌
+        rate: 每秒补充的令牌数
+        burst: 桶容量
+        返回 (是否允许, 需要等待的秒数)
+        '''
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    def refund(self, key, burst, cost=1.0):
+        """退还acquire取出的令牌（请求随后被拒绝、没有执行时调用）"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                self._buckets[key] = (min(burst, bucket[0] + cost), bucket[1])
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SharedMemoryBucketBackend:
+    """
+    共享内存令牌桶，同一台机器上的多个工作进程共享限额
+    桶保存在固定大小的开放寻址哈希表中，读写时用文件锁（fcntl）互斥；
+    表满时覆盖探测范围内最久未访问的桶
+    """
+
+    SLOT_DTYPE = np.dtype([('key', np.uint64), ('tokens', np.float64), ('last', np.float64)])
+
+    def __init__(self, name='qa_admission', slots=4096, probes=8, lock_path=None):
+        '''
+        name: 共享内存名称，使用相同名称的进程共享令牌桶
+        slots: 哈希表大小（最多同时跟踪的客户端数）
+        probes: 冲突时最多探测的位置数
+        lock_path: 文件锁路径，默认在临时目录下
+        '''
+        self.name = name
+        self.slots = slots
+        self.probes = probes
+        size = slots * self.SLOT_DTYPE.itemsize
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            np.frombuffer(self._shm.buf, dtype=np.uint8)[:size] = 0
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+            if self._shm.size != size:
+                # 残留的同名共享内存大小不同（slots配置变化），删除后按当前大小重新创建
+                print(f"共享内存 {name} 的大小（{self._shm.size}）与配置（{size}）不一致，重新创建")
+                self._shm.close()
+                self._shm.unlink()
+                self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+                np.frombuffer(self._shm.buf, dtype=np.uint8)[:size] = 0
+        # 共享内存的生命周期由unlink()显式管理，不随某个进程退出而被删除
+        resource_tracker.unregister(self._shm._name, 'shared_memory')
+        self._table = np.ndarray((slots,), dtype=self.SLOT_DTYPE, buffer=self._shm.buf)
+        self._lock_file = open(lock_path or os.path.join(tempfile.gettempdir(), f'{name}.lock'), 'a+')
+        # 文件锁只在进程之间互斥，同一进程内的线程还需要线程锁
+        self._thread_lock = threading.Lock()
+
+    @staticmethod
+    def _hash(key):
+        data = key.encode('utf-8')
+        # 0表示空位，因此哈希值取值范围为 [1, 2^64 - 1]
+        return (zlib.crc32(data) << 32 | zlib.adler32(data)) % 0xFFFFFFFFFFFFFFFF + 1
+
+    def acquire(self, key, rate, burst, cost=1.0):
+        '''
+        从key对应的桶中取出cost个令牌
+        返回 (是否允许, 需要等待的秒数)
+        '''
+        key_hash = self._hash(key)
+        now = time.time()
+        with self._thread_lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                table = self._table
+                start = key_hash % self.slots
+                slot = None
+                oldest = None
+                for i in range(self.probes):
+                    index = (start + i) % self.slots
+                    stored = int(table['key'][index])
+                    if stored == key_hash or stored == 0:
+                        slot = index
+                        break
+                    if oldest is None or table['last'][index] < table['last'][oldest]:
+                        oldest = index
+                if slot is None or int(table['key'][slot]) != key_hash:
+                    slot = slot if slot is not None else oldest
+                    table[slot] = (key_hash, burst, now)
+                tokens = min(burst, float(table['tokens'][slot]) + max(0.0, now - float(table['last'][slot])) * rate)
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+                table['tokens'][slot] = tokens
+                table['last'][slot] = now
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    def refund(self, key, burst, cost=1.0):
+        """退还acquire取出的令牌（请求随后被拒绝、没有执行时调用）"""
+        key_hash = self._hash(key)
+        with self._thread_lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                table = self._table
+                start = key_hash % self.slots
+                for i in range(self.probes):
+                    index = (start + i) % self.slots
+                    if int(table['key'][index]) == key_hash:
+                        table['tokens'][index] = min(burst, float(table['tokens'][index]) + cost)
+                        break
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def __len__(self):
+        return int(np.count_nonzero(self._table['key']))
+
+    def close(self):
+        self._table = None
+        self._shm.close()
+        self._lock_file.close()
+
+    def unlink(self):
+        """删除共享内存（所有进程都不再使用后调用）"""
+        # unlink时会向resource_tracker注销，先重新注册以免报错
+        resource_tracker.register(self._shm._name, 'shared_memory')
+        self._shm.unlink()
+
+
+class AdmissionRejected(Exception):
+    """请求未被接受"""
+
+    def __init__(self, reason, retry_after=1.0, limit=None):
+        '''
+        reason: rate_limited/queue_full/timeout/too_large
+        retry_after: 建议的重试等待秒数，为None时表示重试也不会成功
+        limit: too_large时单个请求允许消耗的最大令牌数
+        '''
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.limit = limit
+
+
+class AdmissionController:
+    """令牌桶限流 + 按优先级排队的并发控制"""
+
+    def __init__(self, max_concurrent=8, queue_limits=None, queue_timeout=10.0, rate_limits=None,
+                 backend=None, wait_window=1000, trusted_proxies=()):
+        '''
+        max_concurrent: 同时执行的请求数
+        queue_limits: 优先级 -> 最多排队的请求数，排队数达到上限时直接拒绝
+        queue_timeout: 排队超过该秒数仍未执行时拒绝
+        rate_limits: 优先级 -> (每秒令牌数, 桶容量)，每个客户端每个优先级一个令牌桶，None表示不限流
+        backend: 令牌桶后端（默认进程内存）
+        wait_window: 统计排队等待时间时保留的最近样本数
+        trusted_proxies: 可信反向代理的IP地址，只有来自这些地址的请求才使用请求头 X-Client-Id 区分客户端
+        '''
+        self.max_concurrent = max_concurrent
+        self.queue_limits = queue_limits or {'interactive': 64, 'bulk': 16}
+        self.queue_timeout = queue_timeout
+        self.rate_limits = rate_limits or {}
+        self.backend = backend if backend is not None else MemoryBucketBackend()
+        self.trusted_proxies = frozenset(trusted_proxies)
+        self._lock = threading.Lock()
+        self._active = 0
+        # 等待队列：(优先级, 序号, 事件)
+        self._waiting = []
+        self._depth = {name: 0 for name in PRIORITIES}
+        self._sequence = itertools.count()
+        self._waits = {name: deque(maxlen=wait_window) for name in PRIORITIES}
+        self._counters = {name: {'admitted': 0, 'rate_limited': 0, 'queue_full': 0, 'timeout': 0, 'too_large': 0}
+                          for name in PRIORITIES}
+
+    def check_rate(self, client, priority, cost=1.0):
+        """令牌桶限流，超出限额时抛出AdmissionRejected"""
+        limit = self.rate_limits.get(priority)
+        if limit is None:
+            return
+        rate, burst = limit
+        if cost > burst:
+            # 桶中的令牌数不会超过容量，这样的请求等待多久都不会被接受
+            with self._lock:
+                self._counters[priority]['too_large'] += 1
+            raise AdmissionRejected('too_large', None, burst)
+        allowed, retry_after = self.backend.acquire(f'{priority}:{client}', rate, burst, cost)
+        if not allowed:
+            with self._lock:
+                self._counters[priority]['rate_limited'] += 1
+            raise AdmissionRejected('rate_limited', retry_after)
+
+    def refund_rate(self, client, priority, cost=1.0):
+        """退还check_rate取出的令牌"""
+        limit = self.rate_limits.get(priority)
+        if limit is not None:
+            self.backend.refund(f'{priority}:{client}', limit[1], cost)
+
+    def admit(self, client, priority, cost=1.0):
+        '''
+        限流并取得执行名额，返回排队等待的秒数
+        排队已满或等待超时的请求没有执行，取出的令牌退还给客户端，不占用其限额
+        '''
+        self.check_rate(client, priority, cost)
+        try:
+            return self.acquire(priority)
+        except AdmissionRejected:
+            self.refund_rate(client, priority, cost)
+            raise
+
+    def acquire(self, priority):
+        '''
+        取得一个执行名额，名额已满时按优先级排队
+        返回排队等待的秒数；队列已满或等待超时时抛出AdmissionRejected
+        '''
+        start = time.perf_counter()
+        with self._lock:
+            if self._active < self.max_concurrent and not self._waiting:
+                self._active += 1
+                self._record_wait(priority, 0.0)
+                return 0.0
+            if self._depth[priority] >= self.queue_limits.get(priority, 0):
+                # 快速拒绝，不占用工作线程
+                self._counters[priority]['queue_full'] += 1
+                raise AdmissionRejected('queue_full', self.queue_timeout)
+            entry = (PRIORITIES[priority], next(self._sequence), threading.Event())
+            heapq.heappush(self._waiting, entry)
+            self._depth[priority] += 1
+
+        granted = entry[2].wait(self.queue_timeout)
+        with self._lock:
+            if not granted and not entry[2].is_set():
+                # 超时：从队列中移除
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._depth[priority] -= 1
+                self._counters[priority]['timeout'] += 1
+                raise AdmissionRejected('timeout', self.queue_timeout)
+            waited = time.perf_counter() - start
+            self._record_wait(priority, waited)
+        return waited
+
+    def release(self):
+        """释放执行名额，直接交给优先级最高、等待最久的请求"""
+        with self._lock:
+            if self._waiting:
+                priority_value, _, event = heapq.heappop(self._waiting)
+                for name, value in PRIORITIES.items():
+                    if value == priority_value:
+                        self._depth[name] -= 1
+                        break
+                event.set()
+            else:
+                self._active -= 1
+
+    def _record_wait(self, priority, waited):
+        """记录排队等待时间（调用方持有锁）"""
+        self._waits[priority].append(waited)
+        self._counters[priority]['admitted'] += 1
+
+    def stats(self):
+        """执行中和排队中的请求数、各优先级的拒绝次数和排队等待时间"""
+        with self._lock:
+            result = {
+                'active': self._active,
+                'max_concurrent': self.max_concurrent,
+                'rate_limited_clients': len(self.backend),
+                'priorities': {}
+            }
+            for name in PRIORITIES:
+                waits = np.array(self._waits[name]) * 1000 if self._waits[name] else np.zeros(1)
+                result['priorities'][name] = dict(self._counters[name], **{
+                    'queued': self._depth[name],
+                    'queue_limit': self.queue_limits.get(name, 0),
+                    'queue_wait_ms': {
+                        'mean': float(waits.mean()),
+                        'p50': float(np.percentile(waits, 50)),
+                        'p95': float(np.percentile(waits, 95)),
+                        'max': float(waits.max())
+                    }
+                })
+        return result
+
+    def client_id(self, request):
+        '''
+        限流使用的客户端标识
+        默认为对端IP地址；请求来自可信反向代理时使用代理设置的请求头 X-Client-Id，
+        避免客户端通过伪造请求头为每个请求取得新的令牌桶
+        '''
+        address = request.remote_addr or 'unknown'
+        if address in self.trusted_proxies:
+            return request.headers.get('X-Client-Id') or address
+        return address
+
+    def limit(self, priority='interactive', cost=None):
+        '''
+        Flask路由装饰器
+        priority: 请求的优先级（interactive/bulk）
+        cost: (request) -> 消耗的令牌数，默认每个请求1个
+        '''
+        from flask import jsonify, request
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                try:
+                    self.admit(self.client_id(request), priority, cost(request) if cost else 1.0)
+                except AdmissionRejected as e:
+                    if e.reason == 'too_large':
+                        # 不可重试：请求本身超出单次上限
+                        response = jsonify({'error': f'请求过大，单个请求最多消耗 {e.limit:g} 个令牌',
+                                            'reason': e.reason, 'limit': e.limit})
+                        response.status_code = 413
+                        return response
+                    messages = {'rate_limited': '请求过于频繁，请稍后再试',
+                                'queue_full': '服务繁忙，请稍后再试',
+                                'timeout': '服务繁忙，请稍后再试'}
+                    response = jsonify({'error': messages[e.reason], 'reason': e.reason})
+                    response.status_code = 429
+                    response.headers['Retry-After'] = str(max(1, int(round(e.retry_after))))
+                    return response
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    self.release()
+            return wrapper
+        return decorator
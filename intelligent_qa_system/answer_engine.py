@@ -0,0 +1,187 @@
+"""
+分级问答引擎
+按成本从低到高依次尝试：本地问答检索 -> 语义缓存 -> 本地Seq2Seq生成 -> 豆包API，
+本地生成结果的置信度（每个词的平均对数概率、_UNK比例）达到阈值时直接返回，否则转交豆包API；
+多轮对话中依赖上下文的追问直接带着历史对话转交豆包API；
+记录每次请求的路由结果和各级耗时，用于调整阈值
+"""
+import datetime
+import re
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+# 各级的名称（按尝试顺序）
+TIERS = ('retrieval', 'cache', 'seq2seq', 'remote')
+TIER_LABELS = {'retrieval': '检索', 'cache': '语义缓存', 'seq2seq': '本地生成', 'remote': '豆包API'}
+
+# 追问常用的开头（省略了主语或承接上一轮）
+FOLLOW_UP_PREFIXES = ('那', '还有', '然后', '所以', '为什么', '为啥', '怎么会', '如果', '另外', '再', '也', '还')
+# 指代上文的代词和说法
+FOLLOW_UP_WORDS = ('它', '他', '她', '这个', '那个', '这些', '那些', '这样', '那样', '这种', '那种', '其中',
+                   '上面', '刚才', '前面', '之前', '上一个', '继续', '详细', '具体', '举个例子', '为什么')
+# 判断长度时忽略的标点和语气词
+FOLLOW_UP_IGNORED_PATTERN = re.compile(r'[\s，。！？、；：,.!?;:"\'“”‘’（）()…~～吗呢吧啊呀哦嗯]')
+
+
+def is_context_dependent(question, max_chars=2):
+    '''
+    问题是否依赖上文才能回答：以追问词开头、含有指代上文的词、以“呢”结尾的省略问句（如“上海呢”），
+    或去掉标点和语气词后不超过max_chars个字（如“为什么”“然后呢”“好的”）
+    '''
+    question = question.strip()
+    if question.startswith(FOLLOW_UP_PREFIXES) or any(word in question for word in FOLLOW_UP_WORDS):
+        return True
+    if question.rstrip('？?。.！! ').endswith('呢'):
+        return True
+    return len(FOLLOW_UP_IGNORED_PATTERN.sub('', question)) <= max_chars
+
+
+class AnswerEngine:
+    """分级问答：命中本地结果时不再调用豆包API"""
+
+    def __init__(self, doubao, nlp_models, retrieval_index=None, semantic_cache=None, retrieval_threshold=0.8,
+                 local_generator=True, min_log_prob=-0.5, max_unk_ratio=0.2, max_length=50,
+                 log_routing=True, latency_window=1000, context_fn=is_context_dependent):
+        '''
+        doubao: 豆包API
+        nlp_models: NLPModels（提供本地Seq2Seq生成）
+        retrieval_index: 本地问答检索索引，None表示不使用
+        semantic_cache: 语义缓存，None表示不使用
+        retrieval_threshold: 检索得分不低于该值时直接返回检索到的答案
+        local_generator: 是否尝试本地Seq2Seq生成
+        min_log_prob: 生成回复每个词的平均对数概率低于该值时转交豆包API
+        max_unk_ratio: 输入中_UNK的比例高于该值时转交豆包API（生成的回复中有_UNK时总是转交）
+        max_length: 本地生成的最大词数
+        log_routing: 是否打印每次请求的路由结果和各级耗时
+        latency_window: 统计各级耗时时保留的最近样本数
+        context_fn: 问题 -> 是否依赖上文；有历史对话且依赖上文时跳过本地各级，为None时有历史对话就跳过
+        '''
+        self.doubao = doubao
+        self.nlp_models = nlp_models
+        self.retrieval_index = retrieval_index
+        self.semantic_cache = semantic_cache
+        self.retrieval_threshold = retrieval_threshold
+        self.local_generator = local_generator
+        self.min_log_prob = min_log_prob
+        self.max_unk_ratio = max_unk_ratio
+        self.max_length = max_length
+        self.log_routing = log_routing
+        self.context_fn = context_fn
+        self._lock = threading.Lock()
+        self._latencies = {tier: deque(maxlen=latency_window) for tier in TIERS}
+        self._sources = {tier: 0 for tier in TIERS}
+        self._attempts = {tier: 0 for tier in TIERS}
+        self.rejected_generations = 0
+
+    def is_confident(self, generated):
+        """本地生成的回复是否达到置信度阈值"""
+        return (bool(generated['reply'])
+                and generated['mean_log_prob'] is not None
+                and generated['mean_log_prob'] >= self.min_log_prob
+                # 回复中的_UNK会原样显示给用户
+                and generated['unk_ratio'] == 0
+                and generated['input_unk_ratio'] <= self.max_unk_ratio)
+
+    def answer(self, question, history=None):
+        '''
+        回答问题
+        history: 会话的历史对话；问题依赖上文时跳过检索、语义缓存和本地生成（三者都不考虑上下文），
+                 带着历史对话转交豆包API，不依赖上文的问题仍先尝试本地各级
+        返回 {'success', 'reply'（失败时为'error'）, 'source'（回答来自哪一级）, 'tier_ms'（各级耗时）,
+             'confidence'（回答来自本地生成时的置信度）}
+        '''
+        history = history or []
+        tier_ms = {}
+        result, confidence = self._route(question, history, tier_ms)
+        result['tier_ms'] = tier_ms
+
+        with self._lock:
+            self._sources[result['source']] += 1
+            for tier, elapsed in tier_ms.items():
+                self._attempts[tier] += 1
+                self._latencies[tier].append(elapsed)
+            if confidence is not None and result['source'] != 'seq2seq':
+                self.rejected_generations += 1
+
+        if self.log_routing:
+            timings = '，'.join(f'{TIER_LABELS[tier]} {elapsed:.1f}ms' for tier, elapsed in tier_ms.items())
+            detail = ''
+            if confidence is not None:
+                mean_log_prob = confidence['mean_log_prob']
+                detail = (f"；平均对数概率 {'-' if mean_log_prob is None else f'{mean_log_prob:.2f}'}，"
+                          f"_UNK比例 {confidence['input_unk_ratio']:.2f}/{confidence['unk_ratio']:.2f}")
+            print(f"[{datetime.datetime.now()}] 问答路由: {result['source']}（{timings}{detail}）")
+        return result
+
+    def _route(self, question, history, tier_ms):
+        """依次尝试各级，返回 (结果, 本地生成的置信度)，记录各级耗时（毫秒）到tier_ms"""
+        # 依赖上文的追问（如“为什么”“然后呢”“上海呢”）只有带着历史对话才能回答
+        local = not history or (self.context_fn is not None and not self.context_fn(question))
+        if self.retrieval_index is not None and local:
+            start = time.perf_counter()
+            hits = self.retrieval_index.search(question)
+            tier_ms['retrieval'] = (time.perf_counter() - start) * 1000
+            if hits and hits[0]['score'] >= self.retrieval_threshold:
+                return {'success': True, 'reply': hits[0]['answer'], 'source': 'retrieval'}, None
+
+        question_vector = None
+        if self.semantic_cache is not None and local:
+            start = time.perf_counter()
+            cache_hit, question_vector = self.semantic_cache.lookup(question)
+            tier_ms['cache'] = (time.perf_counter() - start) * 1000
+            if cache_hit:
+                return {'success': True, 'reply': cache_hit['answer'], 'source': 'cache'}, None
+
+        confidence = None
+        # Seq2Seq模型是单轮模型，依赖上文的追问直接转交豆包API
+        if self.local_generator and local:
+            start = time.perf_counter()
+            generated = self.nlp_models.generate_reply(question, self.max_length)
+            tier_ms['seq2seq'] = (time.perf_counter() - start) * 1000
+            if generated is not None:
+                confidence = {key: generated[key] for key in ('mean_log_prob', 'unk_ratio', 'input_unk_ratio')}
+                if self.is_confident(generated):
+                    return {'success': True, 'reply': generated['reply'], 'source': 'seq2seq',
+                            'confidence': confidence}, confidence
+
+        start = time.perf_counter()
+        qa_result = self.doubao.chat(question, history=history)
+        tier_ms['remote'] = (time.perf_counter() - start) * 1000
+        # 依赖上下文的回答不放入语义缓存
+        if qa_result['success'] and self.semantic_cache is not None and local:
+            self.semantic_cache.store(question, qa_result['reply'], question_vector)
+        return dict(qa_result, source='remote'), confidence
+
+    def stats(self):
+        """各级的回答次数和耗时报告"""
+        with self._lock:
+            total = sum(self._sources.values())
+            result = {
+                'total': total,
+                'thresholds': {
+                    'retrieval_score': self.retrieval_threshold,
+                    'min_log_prob': self.min_log_prob,
+                    'max_unk_ratio': self.max_unk_ratio
+                },
+                'local_generator': self.local_generator,
+                'rejected_generations': self.rejected_generations,
+                'tiers': {}
+            }
+            for tier in TIERS:
+                latencies = np.array(self._latencies[tier]) if self._latencies[tier] else np.zeros(1)
+                result['tiers'][tier] = {
+                    'answered': self._sources[tier],
+                    'answer_rate': self._sources[tier] / total if total else 0.0,
+                    'attempts': self._attempts[tier],
+                    'latency_ms': {
+                        'mean': float(latencies.mean()),
+                        'p50': float(np.percentile(latencies, 50)),
+                        'p95': float(np.percentile(latencies, 95)),
+                        'max': float(latencies.max())
+                    }
+                }
+        return result
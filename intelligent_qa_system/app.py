@@ -5,6 +5,16 @@
 from flask import Flask, render_template, request, jsonify
 from doubao_api import DoubaoAPI
 from nlp_models import NLPModels
+from bulk_translate import BulkTranslator, TranslationQueueFull
+from semantic_cache import SemanticCache
+from retrieval import load_or_build_index
+from session_store import SessionManager, MemorySessionBackend, SQLiteSessionBackend
+from admission import AdmissionController, MemoryBucketBackend, SharedMemoryBucketBackend
+from fast_json import json_response, parse_fields
+from answer_engine import AnswerEngine, is_context_dependent
+import datetime
+import hmac
+import os
 import re
 
 
@@ -16,8 +26,68 @@ DOUBAO_API_KEY = '5fe8c115-d78c-4fae-90be-6a2075f29f7e'
 DOUBAO_MODEL = 'doubao-seed-1-6-lite-251015'
 doubao = DoubaoAPI(DOUBAO_API_KEY, DOUBAO_MODEL)
 
+# 初始化批量翻译（限制并发的上游调用数和单片段token预算）
+BULK_TRANSLATE_WORKERS = 4
+BULK_TRANSLATE_CHUNK_TOKENS = 800
+BULK_TRANSLATE_MAX_PENDING_CHUNKS = 2000  # 排队和执行中的片段数上限，超出时返回503
+bulk_translator = BulkTranslator(doubao, BULK_TRANSLATE_WORKERS, BULK_TRANSLATE_CHUNK_TOKENS,
+                                 max_pending_chunks=BULK_TRANSLATE_MAX_PENDING_CHUNKS)
+
 # 初始化NLP模型
 nlp_models = NLPModels()
+# 每隔多少秒检查一次模型文件，文件更新后在后台加载新版本并替换（0为不自动检查）
+MODEL_WATCH_INTERVAL = 10
+# 管理接口的访问令牌（请求头 X-Admin-Token），未设置时管理接口一律返回403
+ADMIN_TOKEN = os.environ.get('QA_ADMIN_TOKEN', '')
+
+# 初始化语义答案缓存（相近的问题直接复用已有回答）
+SEMANTIC_CACHE_CAPACITY = 2000
+SEMANTIC_CACHE_THRESHOLD = 0.56  # 由 python semantic_cache.py 在 data/semantic_cache_pairs.txt 上校准（实词签名相同时才比较相似度）
+SEMANTIC_CACHE_TTL = 86400  # 条目的有效期（秒），None为不过期；询问当前时间、今天/明天等问题始终不缓存
+semantic_cache = SemanticCache(nlp_models.embed_text, SEMANTIC_CACHE_CAPACITY, SEMANTIC_CACHE_THRESHOLD,
+                               ttl=SEMANTIC_CACHE_TTL)
+
+# 本地问答检索索引（对话语料 + FAQ），匹配度足够高时直接回答，不调用豆包API
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RETRIEVAL_INDEX_PATH = os.path.join(BASE_DIR, 'tmp', 'retrieval_index.json')
+RETRIEVAL_IDS_PATH = os.path.join(BASE_DIR, 'data', 'ids')
+RETRIEVAL_FAQ_PATHS = [os.path.join(BASE_DIR, 'data', 'faq.txt')]
+RETRIEVAL_THRESHOLD = 0.8
+RETRIEVAL_USE_VECTORS = False
+
+# 多轮对话会话（按conversation_id保存最近的对话，超出预算的较早轮次压缩为摘要）
+SESSION_BACKEND = 'memory'  # 'memory' 或 'sqlite'
+SESSION_DB_PATH = os.path.join(BASE_DIR, 'tmp', 'sessions.db')
+SESSION_MAX_TURNS = 20
+SESSION_TOKEN_BUDGET = 1500
+SESSION_TTL = 1800
+SESSION_MAX_SESSIONS = 10000
+session_manager = SessionManager(
+    SQLiteSessionBackend(SESSION_DB_PATH) if SESSION_BACKEND == 'sqlite' else MemorySessionBackend(),
+    SESSION_MAX_TURNS, SESSION_TOKEN_BUDGET, SESSION_TTL, SESSION_MAX_SESSIONS)
+
+# 请求准入控制：按客户端IP限流，/message 优先于 /analyze、/translate 等批量请求执行
+ADMISSION_BACKEND = 'memory'  # 'memory' 或 'shared'（多个工作进程共享限额）
+ADMISSION_MAX_CONCURRENT = 8  # 同时执行的请求数
+ADMISSION_QUEUE_LIMITS = {'interactive': 64, 'bulk': 16}  # 各优先级最多排队的请求数，超出时直接返回429
+ADMISSION_QUEUE_TIMEOUT = 10  # 排队超过该秒数返回429
+ADMISSION_RATE_LIMITS = {'interactive': (2, 10), 'bulk': (5, 20)}  # 每个客户端的 (每秒令牌数, 桶容量)，桶容量也是单个请求的上限
+ADMISSION_TRUSTED_PROXIES = ()  # 可信反向代理的IP，来自这些地址的请求按代理设置的请求头 X-Client-Id 区分客户端
+admission = AdmissionController(
+    ADMISSION_MAX_CONCURRENT, ADMISSION_QUEUE_LIMITS, ADMISSION_QUEUE_TIMEOUT, ADMISSION_RATE_LIMITS,
+    SharedMemoryBucketBackend() if ADMISSION_BACKEND == 'shared' else MemoryBucketBackend(),
+    trusted_proxies=ADMISSION_TRUSTED_PROXIES)
+
+# 分级问答：依次尝试本地问答检索、语义缓存、本地Seq2Seq生成（tmp/model 中的检查点），都不满足时才调用豆包API
+ANSWER_LOCAL_GENERATOR = True  # 是否尝试本地Seq2Seq生成
+SEQ2SEQ_MIN_LOG_PROB = -0.5  # 生成回复每个词的平均对数概率低于该值时转交豆包API
+SEQ2SEQ_MAX_UNK_RATIO = 0.2  # 输入中_UNK的比例高于该值时转交豆包API（生成的回复中出现_UNK时总是转交）
+SEQ2SEQ_MAX_LENGTH = 50  # 本地生成的最大词数
+ANSWER_LOG_ROUTING = True  # 打印每次问答的路由结果和各级耗时
+ANSWER_LOCAL_FOLLOW_UPS = True  # 多轮对话中不依赖上文的问题也先尝试本地各级（False时有历史对话就直接调用豆包API）
+
+# /message 和 /analyze 的响应序列化：True 时使用 fast_json（安装了orjson时直接序列化NumPy数据），False 时使用 jsonify
+FAST_JSON = True
 
 # 加载模型（如果可用）
 print("=" * 60)
@@ -40,6 +110,45 @@ try:
 except Exception as e:
     print(f"  ✗ 情感分析词典加载失败: {str(e)}")
 
+if ANSWER_LOCAL_GENERATOR:
+    try:
+        if nlp_models.load_seq2seq():
+            print("  ✓ Seq2Seq对话模型已加载")
+        else:
+            print("  ✗ Seq2Seq对话模型不可用（问答将直接调用豆包API）")
+    except Exception as e:
+        print(f"  ✗ Seq2Seq对话模型加载失败: {str(e)}")
+
+try:
+    retrieval_index = load_or_build_index(
+        RETRIEVAL_INDEX_PATH, RETRIEVAL_IDS_PATH, RETRIEVAL_FAQ_PATHS,
+        nlp_models.embed_text if RETRIEVAL_USE_VECTORS else None)
+    print(f"  ✓ 问答检索索引已加载（{len(retrieval_index)} 条问答）")
+except Exception as e:
+    retrieval_index = None
+    print(f"  ✗ 问答检索索引加载失败: {str(e)}")
+
+
+def on_text_classifier_update(version):
+    """文本分类模型更新后词嵌入空间随之变化，旧模型计算的句向量不能再与新的查询向量比较"""
+    semantic_cache.clear()
+    if retrieval_index is not None:
+        retrieval_index.rebuild_vectors()
+    print(f"[{datetime.datetime.now()}] 文本分类模型已更新到版本 {version}，语义缓存已清空，检索向量已重建")
+
+
+nlp_models.registry.on_update('text_classifier', on_text_classifier_update)
+if MODEL_WATCH_INTERVAL:
+    nlp_models.registry.start_watching(MODEL_WATCH_INTERVAL)
+
+answer_engine = AnswerEngine(
+    doubao, nlp_models, retrieval_index, semantic_cache, RETRIEVAL_THRESHOLD,
+    ANSWER_LOCAL_GENERATOR, SEQ2SEQ_MIN_LOG_PROB, SEQ2SEQ_MAX_UNK_RATIO, SEQ2SEQ_MAX_LENGTH, ANSWER_LOG_ROUTING,
+    context_fn=is_context_dependent if ANSWER_LOCAL_FOLLOW_UPS else None)
+
+if not ADMIN_TOKEN:
+    print("  ✗ 未设置环境变量 QA_ADMIN_TOKEN，管理接口（/admin/*、/retrieval/add）已禁用")
+
 print("\n✓ 系统初始化完成！")
 print("=" * 60)
 print("功能包括：")
@@ -110,11 +219,17 @@ def index():
 
 
 @app.route('/message', methods=['POST'])
+@admission.limit('interactive')
 def reply():
     """智能问答接口"""
     try:
         # 获取用户输入
         user_msg = request.form.get('msg', '').strip()
+        conversation_id = request.form.get('conversation_id', '').strip()
+        # 可选字段：不需要格式化文本或各类别概率的客户端可以省去这部分的生成和传输
+        fields = parse_fields(request.form.get('fields'))
+        include_text = 'text' in fields
+        include_probabilities = 'all_probabilities' in fields
         
         if not user_msg:
             return jsonify({'text': '请输入您的问题或需要处理的内容。', 'type': 'error'})
@@ -123,7 +238,6 @@ def reply():
         function_type = detect_function(user_msg)
         
         result = {
-            'text': '',
             'type': function_type,
             'analysis': {}
         }
@@ -146,7 +260,8 @@ def reply():
             
             # 使用豆包API进行翻译
             translation = doubao.translate(translate_text, target_lang)
-            result['text'] = f"🌐 翻译结果:\n原文: {translation['original']}\n译文: {translation['translated']}"
+            if include_text:
+                result['text'] = f"🌐 翻译结果:\n原文: {translation['original']}\n译文: {translation['translated']}"
             result['analysis']['translation'] = translation
         
         elif function_type == 'sentiment':
@@ -165,7 +280,8 @@ def reply():
                 neg_words = sentiment_result.get('negative_words', 0)
                 
                 emoji = '😊' if sentiment_type == '正面' else '😞' if sentiment_type == '负面' else '😐'
-                result['text'] = f"{emoji} 情感分析结果:\n情感倾向: {sentiment_type}\n置信度: {sentiment_conf:.2%}\n正面词汇数: {pos_words}\n负面词汇数: {neg_words}"
+                if include_text:
+                    result['text'] = f"{emoji} 情感分析结果:\n情感倾向: {sentiment_type}\n置信度: {sentiment_conf:.2%}\n正面词汇数: {pos_words}\n负面词汇数: {neg_words}"
                 result['analysis']['sentiment'] = sentiment_result
             else:
                 result['text'] = "情感分析功能暂时不可用，请稍后再试。"
@@ -178,34 +294,43 @@ def reply():
                     classify_text = classify_text.split(keyword)[-1].strip()
                     break
             
-            classification_result = nlp_models.classify_text(classify_text)
+            classification_result = nlp_models.classify_text(classify_text, include_probabilities)
             if classification_result:
                 category = classification_result.get('category', '未知')
                 confidence = classification_result.get('confidence', 0)
-                result['text'] = f"📊 文本分类结果:\n类别: {category}\n置信度: {confidence:.2%}"
+                if include_text:
+                    result['text'] = f"📊 文本分类结果:\n类别: {category}\n置信度: {confidence:.2%}"
                 result['analysis']['classification'] = classification_result
             else:
                 result['text'] = "文本分类功能暂时不可用，请稍后再试。"
         
         else:
             # 默认：智能问答 + 自动分析
-            qa_result = doubao.chat(user_msg)
+            # 依次尝试本地问答索引、语义缓存、本地Seq2Seq生成，都不满足时才调用豆包API
+            history = session_manager.get_history(conversation_id) if conversation_id else []
+            qa_result = answer_engine.answer(user_msg, history)
+            result['source'] = qa_result['source']
             
             if qa_result['success']:
                 reply_text = qa_result['reply']
+                if conversation_id:
+                    session_manager.append_turn(conversation_id, user_msg, reply_text)
                 
                 # 自动执行文本分类和情感分析
-                classification = nlp_models.classify_text(user_msg)
+                classification = nlp_models.classify_text(user_msg, include_probabilities)
                 sentiment = nlp_models.analyze_sentiment(user_msg)
                 
-                # 组合回复
-                result['text'] = format_response_with_analysis(user_msg, reply_text, classification, sentiment)
+                # 组合回复（不需要格式化文本时只返回原始回答）
+                if include_text:
+                    result['text'] = format_response_with_analysis(user_msg, reply_text, classification, sentiment)
+                else:
+                    result['reply'] = reply_text
                 result['analysis']['classification'] = classification
                 result['analysis']['sentiment'] = sentiment
             else:
                 result['text'] = f"抱歉，我无法回答这个问题。错误信息: {qa_result.get('error', '未知错误')}"
         
-        return jsonify(result)
+        return json_response(result) if FAST_JSON else jsonify(result)
     
     except Exception as e:
         return jsonify({
@@ -215,11 +340,13 @@ def reply():
 
 
 @app.route('/analyze', methods=['POST'])
+@admission.limit('bulk')
 def analyze():
     """专门的文本分析接口"""
     try:
         text = request.form.get('text', '').strip()
         analysis_type = request.form.get('type', 'all')
+        include_probabilities = 'all_probabilities' in parse_fields(request.form.get('fields'))
         
         if not text:
             return jsonify({'error': '请提供要分析的文本'})
@@ -227,20 +354,21 @@ def analyze():
         result = {}
         
         if analysis_type in ['all', 'classify']:
-            classification = nlp_models.classify_text(text)
+            classification = nlp_models.classify_text(text, include_probabilities)
             result['classification'] = classification
         
         if analysis_type in ['all', 'sentiment']:
             sentiment = nlp_models.analyze_sentiment(text)
             result['sentiment'] = sentiment
         
-        return jsonify(result)
+        return json_response(result) if FAST_JSON else jsonify(result)
     
     except Exception as e:
         return jsonify({'error': str(e)})
 
 
 @app.route('/translate', methods=['POST'])
+@admission.limit('bulk')
 def translate():
     """专门的翻译接口"""
     try:
@@ -257,5 +385,146 @@ def translate():
         return jsonify({'error': str(e)})
 
 
+@app.route('/admission/stats', methods=['GET'])
+def admission_stats():
+    """准入控制统计：执行中/排队中的请求数、拒绝次数和排队等待时间（需要管理令牌）"""
+    if not admin_authorized():
+        return jsonify({'error': '无权访问'}), 403
+    return jsonify(admission.stats())
+
+
+@app.route('/answer/stats', methods=['GET'])
+def answer_stats():
+    """分级问答各级的回答次数和耗时"""
+    return jsonify(answer_engine.stats())
+
+
+@app.route('/session/stats', methods=['GET'])
+def session_stats():
+    """多轮对话会话数和上下文预算"""
+    return jsonify(session_manager.stats())
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """语义缓存命中率和查询耗时"""
+    return jsonify(semantic_cache.stats())
+
+
+@app.route('/retrieval/add', methods=['POST'])
+def retrieval_add():
+    """向本地问答索引增量添加问答对并持久化（检索命中的答案会直接返回给用户，需要管理令牌）"""
+    if not admin_authorized():
+        return jsonify({'error': '无权访问'}), 403
+    try:
+        question = request.form.get('question', '').strip()
+        answer = request.form.get('answer', '').strip()
+        
+        if not question or not answer:
+            return jsonify({'error': '请提供问题和答案'})
+        if retrieval_index is None:
+            return jsonify({'error': '问答检索索引不可用'})
+        
+        doc_id = retrieval_index.add(question, answer)
+        retrieval_index.save(RETRIEVAL_INDEX_PATH)
+        return jsonify({'id': doc_id, 'size': len(retrieval_index)})
+    
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+
+def bulk_translate_cost(req):
+    """批量翻译按文档数消耗令牌"""
+    payload = req.get_json(silent=True)
+    if payload is None:
+        documents = req.form.getlist('documents')
+    else:
+        # 请求体不是JSON对象时由接口返回错误
+        documents = payload.get('documents', []) if isinstance(payload, dict) else []
+    return max(1, len(documents) if isinstance(documents, list) else 1)
+
+
+@app.route('/translate/bulk', methods=['POST'])
+@admission.limit('bulk', cost=bulk_translate_cost)
+def translate_bulk():
+    """批量文档翻译接口，提交任务后通过 /translate/jobs/<job_id> 查询进度"""
+    try:
+        payload = request.get_json(silent=True)
+        if payload is not None and not isinstance(payload, dict):
+            return jsonify({'error': '请求体必须是JSON对象'})
+        if payload:
+            documents = payload.get('documents', [])
+            target_lang = payload.get('target_lang', 'en')
+            wait = bool(payload.get('wait', False))
+        else:
+            documents = request.form.getlist('documents')
+            target_lang = request.form.get('target_lang', 'en')
+            wait = request.form.get('wait', '') in ['1', 'true']
+        
+        if isinstance(documents, str):
+            documents = [documents]
+        documents = [str(doc) for doc in documents if str(doc).strip()]
+        if not documents:
+            return jsonify({'error': '请提供要翻译的文档'})
+        
+        if wait:
+            return jsonify(bulk_translator.translate_documents(documents, target_lang))
+        job = bulk_translator.submit(documents, target_lang)
+        return jsonify(job.to_dict(include_results=False))
+    
+    except TranslationQueueFull as e:
+        if e.too_large:
+            response = jsonify({'error': f'文档过长，单个任务最多 {e.limit} 个片段（本次 {e.requested} 个）',
+                                'reason': 'too_large', 'limit': e.limit})
+            response.status_code = 413
+            return response
+        response = jsonify({'error': '翻译任务过多，请稍后重试', 'reason': 'queue_full'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(max(1, int(round(e.retry_after))))
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+
+@app.route('/translate/jobs/<job_id>', methods=['GET'])
+def translate_job(job_id):
+    """查询批量翻译任务进度，完成后返回译文"""
+    job = bulk_translator.get_job(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'})
+    return jsonify(job.to_dict())
+
+
+def admin_authorized():
+    """校验管理接口的访问令牌，未配置令牌时拒绝所有请求"""
+    if not ADMIN_TOKEN:
+        return False
+    return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN)
+
+
+@app.route('/admin/models', methods=['GET'])
+def admin_models():
+    """查看各模型的版本、加载时间和状态"""
+    if not admin_authorized():
+        return jsonify({'error': '无权访问'}), 403
+    return jsonify(nlp_models.registry.info())
+
+
+@app.route('/admin/models/<name>/reload', methods=['POST'])
+def admin_reload_model(name):
+    """重新加载模型：默认在后台加载并预热，完成后替换；wait=1时等待加载完成"""
+    if not admin_authorized():
+        return jsonify({'error': '无权访问'}), 403
+    if name not in nlp_models.registry.names():
+        return jsonify({'error': f'模型不存在: {name}'})
+    
+    wait = request.values.get('wait', '') in ['1', 'true']
+    success = nlp_models.registry.reload(name, wait=wait)
+    result = nlp_models.registry.info(name)[name]
+    if wait:
+        result['success'] = success
+    return jsonify(result)
+
+
 if __name__ == '__main__':
     app.run(host='127.0.0.1', port=8808, debug=True)
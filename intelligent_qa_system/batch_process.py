@@ -0,0 +1,303 @@
+"""
+离线批处理工具
+流式读取 JSONL/JSON数组/CSV/TXT 文件，分片交给多个工作进程做文本分类和情感分析，
+结果逐批写入 JSONL，并记录检查点以便中断后续跑；无法解析的行作为带error字段的记录写入结果，不中断处理
+
+用法示例：
+    python batch_process.py data.jsonl result.jsonl --text-field content --workers 4
+    python batch_process.py comments.csv result.jsonl --tasks sentiment --resume
+"""
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from collections import deque
+
+
+# 工作进程内的模型实例（每个进程只加载一次）
+_worker_models = None
+_worker_tasks = ()
+
+
+def _init_worker(tasks):
+    """工作进程初始化：加载一次NLP模型"""
+    global _worker_models, _worker_tasks
+    import jieba
+    from nlp_models import NLPModels
+
+    jieba.initialize()
+    _worker_tasks = tasks
+    _worker_models = NLPModels()
+    if 'classify' in tasks:
+        _worker_models.load_text_classifier()
+
+
+def _process_batch(batch):
+    '''
+    处理一个批次，文本为None的记录是无法解析的输入，原样输出
+    返回 (序列化好的结果行, 出错记录数, 工作进程id, 工作进程峰值内存MB)
+    '''
+    valid = [i for i, (_, text) in enumerate(batch) if text is not None]
+    texts = [batch[i][1] for i in valid]
+
+    classifications = None
+    sentiments = None
+    if texts:
+        classifications = _worker_models.classify_texts(texts) if 'classify' in _worker_tasks else None
+        sentiments = _worker_models.analyze_sentiments(texts) if 'sentiment' in _worker_tasks else None
+
+    for j, i in enumerate(valid):
+        record = batch[i][0]
+        if classifications is not None:
+            record['classification'] = classifications[j]
+        if sentiments is not None:
+            record['sentiment'] = sentiments[j]
+    lines = [json.dumps(record, ensure_ascii=False) + '\n' for record, _ in batch]
+    return ''.join(lines), len(batch) - len(valid), os.getpid(), peak_rss_mb()
+
+
+def detect_format(path):
+    """根据扩展名判断输入格式"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.jsonl':
+        return 'jsonl'
+    if ext == '.json':
+        return 'json'
+    if ext == '.csv':
+        return 'csv'
+    return 'txt'
+
+
+def iter_json_array(f, chunk_size=1 << 16):
+    '''
+    流式解析顶层为数组的JSON文件，逐个产出数组元素
+    数组本身的结构错误（缺少逗号、括号不完整等）之后的元素无法定位，抛出ValueError
+    '''
+    decoder = json.JSONDecoder()
+    buf, pos, eof = '', 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        # 单个元素跨越多次读取时读取量翻倍，避免对大元素反复从头解析
+        chunk = f.read(max(chunk_size, len(buf) - pos))
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    skip_whitespace()
+    if pos >= len(buf) or buf[pos] != '[':
+        raise ValueError('JSON输入的顶层必须是数组（每行一条记录请使用 .jsonl 或 --format jsonl）')
+    pos += 1
+    index = 0
+    while True:
+        skip_whitespace()
+        if pos >= len(buf):
+            raise ValueError(f'JSON数组不完整（已读取 {index} 个元素）')
+        if buf[pos] == ']':
+            return
+        if index:
+            if buf[pos] != ',':
+                raise ValueError(f'JSON数组第 {index} 个元素之后缺少逗号')
+            pos += 1
+            skip_whitespace()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ValueError(f'JSON数组第 {index + 1} 个元素无法解析：{e}') from e
+                fill()
+                continue
+            # 位于缓冲区末尾的数字可能还没读完
+            if end == len(buf) and not eof:
+                fill()
+                continue
+            break
+        yield value
+        pos = end
+        index += 1
+
+
+def _to_record(value, text_field):
+    """把JSON值转换为 (记录, 文本)"""
+    if isinstance(value, dict):
+        return value, str(value.get(text_field) or '')
+    return {text_field: value}, str(value)
+
+
+def read_records(path, input_format, text_field='text'):
+    '''
+    流式读取输入文件，逐条产出 (记录, 文本)
+    jsonl中无法解析的行产出 ({'line', 'error'}, None)，仍占一个记录位置，续跑时按位置跳过
+    '''
+    with open(path, 'r', encoding='utf-8', errors='ignore', newline='') as f:
+        if input_format == 'csv':
+            for row in csv.DictReader(f):
+                yield dict(row), row.get(text_field) or ''
+        elif input_format == 'jsonl':
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    value = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield {'line': line_number, 'error': f'无法解析的JSON：{e}'}, None
+                    continue
+                yield _to_record(value, text_field)
+        elif input_format == 'json':
+            for value in iter_json_array(f):
+                yield _to_record(value, text_field)
+        else:
+            for line in f:
+                text = line.rstrip('\r\n')
+                if text.strip():
+                    yield {text_field: text}, text
+
+
+def iter_batches(records, batch_size):
+    """把记录流切成固定大小的批次"""
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def load_checkpoint(checkpoint_path):
+    """读取检查点"""
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint_path, state):
+    """原子地写入检查点，避免中断时留下半个文件"""
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB）"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux下单位是KB，macOS下是字节
+    return usage / 1024 / 1024 if sys.platform == 'darwin' else usage / 1024
+
+
+def memory_report(worker_peaks):
+    """主进程和各工作进程（模型在工作进程中加载和运行）的峰值内存"""
+    report = f'峰值内存：主进程 {peak_rss_mb():.1f} MB'
+    if worker_peaks:
+        report += (f'，工作进程最高 {max(worker_peaks.values()):.1f} MB'
+                   f'（{len(worker_peaks)} 个合计 {sum(worker_peaks.values()):.1f} MB）')
+    return report
+
+
+def run(args):
+    """执行批处理"""
+    tasks = tuple(t.strip() for t in args.tasks.split(',') if t.strip())
+    input_format = args.format if args.format != 'auto' else detect_format(args.input)
+    checkpoint_path = args.checkpoint or args.output + '.ckpt'
+
+    # 续跑：跳过已处理的记录，并截掉检查点之后写了一半的输出
+    processed = 0
+    output_bytes = 0
+    if args.resume:
+        state = load_checkpoint(checkpoint_path)
+        if state and state.get('input') == os.path.abspath(args.input) and os.path.exists(args.output):
+            processed = state['processed']
+            output_bytes = state['output_bytes']
+            print(f'[{datetime.datetime.now()}] 从检查点续跑，已处理 {processed} 条')
+    mode = 'r+' if output_bytes else 'w'
+
+    records = read_records(args.input, input_format, args.text_field)
+    records = itertools.islice(records, processed, None)
+    batches = iter_batches(records, args.batch_size)
+
+    # 限制在途批次数量，使内存占用不随输入规模增长
+    max_in_flight = args.workers * 2
+    ctx = multiprocessing.get_context('spawn')
+    start_time = time.time()
+    last_report = start_time
+    done_this_run = 0
+    failed_this_run = 0
+    # 工作进程id -> 峰值内存（MB）
+    worker_peaks = {}
+
+    with open(args.output, mode, encoding='utf-8') as out, \
+            ctx.Pool(args.workers, initializer=_init_worker, initargs=(tasks,)) as pool:
+        out.seek(output_bytes)
+        out.truncate()
+        pending = deque()
+
+        def drain_one():
+            nonlocal processed, done_this_run, failed_this_run, last_report
+            size, async_result = pending.popleft()
+            lines, failed, worker_pid, worker_peak = async_result.get()
+            out.write(lines)
+            out.flush()
+            processed += size
+            done_this_run += size
+            failed_this_run += failed
+            worker_peaks[worker_pid] = max(worker_peak, worker_peaks.get(worker_pid, 0.0))
+            save_checkpoint(checkpoint_path, {
+                'input': os.path.abspath(args.input),
+                'processed': processed,
+                'output_bytes': out.tell()
+            })
+            now = time.time()
+            if now - last_report >= args.report_interval:
+                rate = done_this_run / (now - start_time)
+                print(f'[{datetime.datetime.now()}] 已处理 {processed} 条，'
+                      f'{rate:.1f} 条/秒，{memory_report(worker_peaks)}')
+                last_report = now
+
+        for batch in batches:
+            pending.append((len(batch), pool.apply_async(_process_batch, (batch,))))
+            if len(pending) >= max_in_flight:
+                drain_one()
+        while pending:
+            drain_one()
+
+    elapsed = time.time() - start_time
+    rate = done_this_run / elapsed if elapsed > 0 else 0.0
+    print(f'[{datetime.datetime.now()}] 处理完成：共 {processed} 条，本次 {done_this_run} 条'
+          f'（无法解析 {failed_this_run} 条），耗时 {elapsed:.1f} 秒，{rate:.1f} 条/秒，{memory_report(worker_peaks)}')
+    return processed
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='离线批量文本分类和情感分析')
+    parser.add_argument('input', help='输入文件（jsonl/json/csv/txt）')
+    parser.add_argument('output', help='输出文件（jsonl）')
+    parser.add_argument('--format', default='auto', choices=['auto', 'jsonl', 'json', 'csv', 'txt'], help='输入格式')
+    parser.add_argument('--text-field', default='text', help='jsonl/csv中文本所在的字段')
+    parser.add_argument('--tasks', default='classify,sentiment', help='要执行的任务，逗号分隔（classify,sentiment）')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1), help='工作进程数')
+    parser.add_argument('--batch-size', type=int, default=256, help='每批次记录数')
+    parser.add_argument('--checkpoint', default=None, help='检查点文件路径（默认为 输出文件.ckpt）')
+    parser.add_argument('--resume', action='store_true', help='从检查点续跑')
+    parser.add_argument('--report-interval', type=float, default=10.0, help='进度输出间隔（秒）')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    run(parse_args())
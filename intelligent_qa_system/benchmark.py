@@ -0,0 +1,486 @@
+"""
+性能基准测试
+包括各热点路径的微基准和针对Flask接口的固定并发压测，豆包API替换为本地桩服务，
+结果以JSON输出（p50/p95/p99延迟、吞吐量、峰值内存），可与历史结果对比发现性能回退
+
+用法示例：
+    python benchmark.py --output bench.json
+    python benchmark.py --only detect_function,jieba_cut --iterations 2000
+    python benchmark.py --compare bench_old.json --tolerance 0.2
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 微基准使用的样例文本
+SAMPLE_TEXTS = [
+    '你好，在吗',
+    '什么是人工智能？',
+    '翻译成英文：今天天气很好',
+    '情感：这家店的服务太棒了，我非常满意',
+    '分类：国足在世界杯预选赛中以二比零战胜对手',
+    '请问这件衣服有货吗？我想要一件中号的',
+    '央行宣布下调存款准备金率，释放长期资金约一万亿元',
+    '这部电影的剧情让人失望，演员的表演也很差'
+]
+
+# 压测时随机组合问题用的词表
+LOAD_SUBJECTS = ['人工智能', '机器学习', '量子计算', '区块链', '新能源汽车', '光伏发电', '基因编辑', '元宇宙',
+                 '云计算', '大数据', '物联网', '自动驾驶', '芯片设计', '太空探索', '碳中和', '数字货币']
+LOAD_ASPECTS = ['发展历史', '核心原理', '应用场景', '未来趋势', '主要挑战', '代表企业', '入门方法', '社会影响']
+LOAD_QUESTIONS = ['是什么', '有哪些', '怎么样', '如何理解']
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB）"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux下单位是KB，macOS下是字节
+    return usage / 1024 / 1024 if sys.platform == 'darwin' else usage / 1024
+
+
+def summarize(latencies, elapsed):
+    """根据每次调用耗时（秒）计算延迟分位数和吞吐量"""
+    ms = np.array(latencies) * 1000
+    return {
+        'iterations': len(latencies),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max()),
+        'throughput_per_sec': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def measure(fn, iterations, warmup=3):
+    """重复调用fn并统计耗时，fn接收调用序号"""
+    for i in range(warmup):
+        fn(i)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+class StubArkHandler(BaseHTTPRequestHandler):
+    """模拟豆包chat/completions接口，按设定的延迟返回固定格式的回复"""
+
+    latency = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if self.latency:
+            time.sleep(self.latency)
+        user_message = body.get('messages', [{}])[-1].get('content', '')
+        data = json.dumps({
+            'id': 'stub',
+            'model': body.get('model'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': f'这是对“{user_message[:50]}”的模拟回答。'},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': len(user_message), 'completion_tokens': 20}
+        }, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(latency_ms=0.0):
+    """在后台线程启动本地桩服务，返回 (server, port)"""
+    handler = type('ConfiguredStubArkHandler', (StubArkHandler,), {'latency': latency_ms / 1000})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_address[1]
+
+
+def build_synthetic_classifier(vocab_size=5000, seq_length=600, num_classes=10):
+    """分类模型文件不可用时，构建结构相近的随机初始化模型，用于测量编码+预测的开销"""
+    import tensorflow as tf
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(seq_length,)),
+        tf.keras.layers.Embedding(vocab_size, 64),
+        tf.keras.layers.Conv1D(256, 5, activation='relu'),
+        tf.keras.layers.GlobalMaxPooling1D(),
+        tf.keras.layers.Dense(128, activation='relu'),
+        tf.keras.layers.Dense(num_classes, activation='softmax')
+    ])
+    return model
+
+
+class BenchmarkContext:
+    """按需加载被测对象，多个基准之间共享"""
+
+    def __init__(self, args):
+        self.args = args
+        self._app = None
+        self._nlp_models = None
+        self._stub = None
+
+    @property
+    def stub_port(self):
+        if self._stub is None:
+            self._stub = start_stub_server(self.args.stub_latency_ms)
+        return self._stub[1]
+
+    def doubao(self):
+        from doubao_api import DoubaoAPI
+        return DoubaoAPI('stub-key', 'stub-model', host='127.0.0.1', port=self.stub_port, use_https=False)
+
+    @property
+    def app(self):
+        """导入Flask应用，并把豆包API指向本地桩服务"""
+        if self._app is None:
+            import app
+            stub = self.doubao()
+            app.doubao.host, app.doubao.port, app.doubao.use_https = stub.host, stub.port, stub.use_https
+            self._app = app
+        return self._app
+
+    @property
+    def nlp_models(self):
+        """已加载分类模型的NLPModels，模型文件不存在时使用结构相近的随机模型"""
+        if self._nlp_models is None:
+            from nlp_models import NLPModels, TextClassifier
+            models = NLPModels()
+            self.synthetic_classifier = not models.load_text_classifier()
+            if self.synthetic_classifier:
+                chars = sorted(set(''.join(SAMPLE_TEXTS)))
+                models.registry.install('text_classifier', TextClassifier(
+                    build_synthetic_classifier(),
+                    {c: i + 1 for i, c in enumerate(chars)},
+                    ('体育', '财经', '房产', '家居', '教育', '科技', '时尚', '时政', '游戏', '娱乐'),
+                    None))
+            self._nlp_models = models
+        return self._nlp_models
+
+
+def bench_detect_function(ctx):
+    detect_function = ctx.app.detect_function
+    return measure(lambda i: detect_function(SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]), ctx.args.iterations)
+
+
+def bench_jieba_cut(ctx):
+    import jieba
+    jieba.initialize()
+    return measure(lambda i: jieba.lcut(SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]), ctx.args.iterations)
+
+
+def bench_classify_text(ctx):
+    models = ctx.nlp_models
+    result = measure(lambda i: models.classify_text(SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]),
+                     max(1, ctx.args.iterations // 10))
+    result['synthetic_model'] = ctx.synthetic_classifier
+    return result
+
+
+def bench_analyze_sentiment(ctx):
+    from nlp_models import NLPModels
+    models = NLPModels()
+    return measure(lambda i: models.analyze_sentiment(SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]), ctx.args.iterations)
+
+
+def bench_doubao_chat(ctx):
+    doubao = ctx.doubao()
+
+    def call(i):
+        result = doubao.chat(SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)])
+        if not result['success']:
+            raise RuntimeError(result['error'])
+    result = measure(call, max(1, ctx.args.iterations // 10))
+    result['stub_latency_ms'] = ctx.args.stub_latency_ms
+    return result
+
+
+def bench_seq2seq_greedy_decode(ctx):
+    import tensorflow as tf
+    import execute
+    from Seq2Seq import greedy_decode
+    os.chdir(BASE_DIR)
+    vocab = execute.load_vocab(execute.data_path)
+    encoder, decoder = execute.build_model(len(vocab))
+    trained = False
+    latest = tf.train.latest_checkpoint(execute.checkpoint_path)
+    if latest:
+        tf.train.Checkpoint(encoder=encoder, decoder=decoder).restore(latest).expect_partial()
+        trained = True
+    inputs = tf.fill([1, execute.MAX_LENGTH], execute.CONST['_UNK'])
+    # eos_id为-1时总是解码到最大长度，保证每次测量的工作量一致
+    result = measure(lambda i: greedy_decode(encoder, decoder, inputs, execute.CONST['_BOS'], -1, execute.MAX_LENGTH),
+                     max(1, ctx.args.iterations // 100), warmup=1)
+    result['decode_steps'] = execute.MAX_LENGTH
+    result['trained_checkpoint'] = trained
+    return result
+
+
+def bench_seq2seq_generate_reply(ctx):
+    """问答本地生成一级：编译后的编码器/解码器，读取 tmp/model 中的检查点"""
+    from nlp_models import NLPModels
+    models = NLPModels()
+    if not models.load_seq2seq():
+        raise RuntimeError('Seq2Seq检查点不存在，请先运行 execute.py 训练')
+    result = measure(lambda i: models.generate_reply(SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]),
+                     max(1, ctx.args.iterations // 10))
+    result['checkpoint'] = models.registry.get('seq2seq').checkpoint
+    return result
+
+
+def bench_train_epoch(ctx):
+    import tensorflow as tf
+    import execute
+    os.chdir(BASE_DIR)
+    vocab = execute.load_vocab(execute.data_path)
+    dataset = execute.build_dataset(vocab.as_tf_table(), execute.data_path, execute.batch_size,
+                                    execute.shuffle_buffer_size)
+    encoder, decoder = execute.build_model(len(vocab))
+    train_step = execute.make_train_step(encoder, decoder, tf.keras.optimizers.Adam())
+    return measure(lambda i: execute.train_epoch(train_step, dataset), ctx.args.train_epochs, warmup=1)
+
+
+def _serialize_analysis(ctx, serialize, include_probabilities=True):
+    """构造分类+情感分析结果并序列化（/analyze 接口中模型推理之后的部分）"""
+    from nlp_models import NLPModels
+    models = ctx.nlp_models
+    classifier = models.registry.get('text_classifier')
+    sentiment = models.analyze_sentiment(SAMPLE_TEXTS[3])
+    rng = np.random.default_rng(0)
+    probs = rng.dirichlet(np.ones(len(classifier.categories)), size=64).astype(np.float32)
+    with ctx.app.app.app_context():
+        return measure(lambda i: serialize({
+            'classification': NLPModels._classification_result(classifier, probs[i % len(probs)],
+                                                                include_probabilities),
+            'sentiment': sentiment
+        }), ctx.args.iterations)
+
+
+def bench_serialize_jsonify(ctx):
+    from flask import jsonify
+    return _serialize_analysis(ctx, lambda result: jsonify(result).get_data())
+
+
+def bench_serialize_fast_json(ctx):
+    from fast_json import json_response, BACKEND
+    result = _serialize_analysis(ctx, lambda result: json_response(result).get_data())
+    result['backend'] = BACKEND
+    return result
+
+
+def bench_serialize_fast_json_compact(ctx):
+    from fast_json import json_response
+    return _serialize_analysis(ctx, lambda result: json_response(result).get_data(), include_probabilities=False)
+
+
+def run_load_scenario(ctx):
+    """以固定并发驱动 /message、/analyze、/translate 接口"""
+    from werkzeug.serving import make_server
+
+    app_module = ctx.app
+    # 压测请求都来自本机同一个地址，关闭按客户端的令牌桶限流，只保留并发控制和排队
+    app_module.admission.rate_limits = {}
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    rng = random.Random(ctx.args.seed)
+
+    def random_question():
+        return rng.choice(LOAD_SUBJECTS) + '的' + rng.choice(LOAD_ASPECTS) + rng.choice(LOAD_QUESTIONS)
+
+    scenarios = {
+        '/message': lambda: {'msg': random_question()},
+        '/analyze': lambda: {'text': rng.choice(SAMPLE_TEXTS), 'type': 'all'},
+        '/translate': lambda: {'text': rng.choice(SAMPLE_TEXTS), 'target_lang': 'en'}
+    }
+    results = {}
+    try:
+        for path, make_payload in scenarios.items():
+            payloads = [make_payload() for _ in range(ctx.args.load_requests)]
+            errors = []
+            rejected = []
+
+            def send(payload):
+                data = urllib.parse.urlencode(payload).encode('utf-8')
+                t = time.perf_counter()
+                try:
+                    with urllib.request.urlopen(base_url + path, data=data, timeout=60) as response:
+                        body = json.loads(response.read())
+                except urllib.error.HTTPError as e:
+                    if e.code != 429:
+                        raise
+                    rejected.append(path)
+                    return time.perf_counter() - t, 'rejected'
+                latency = time.perf_counter() - t
+                if 'error' in body or body.get('type') == 'error':
+                    errors.append(body)
+                return latency, body.get('source')
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=ctx.args.concurrency) as pool:
+                outcomes = list(pool.map(send, payloads))
+            elapsed = time.perf_counter() - start
+            result = summarize([latency for latency, _ in outcomes], elapsed)
+            result['concurrency'] = ctx.args.concurrency
+            result['errors'] = len(errors)
+            result['rejected'] = len(rejected)
+            sources = [source for _, source in outcomes if source]
+            if sources:
+                result['sources'] = {s: sources.count(s) for s in sorted(set(sources))}
+            results[path] = result
+        results['admission'] = app_module.admission.stats()
+    finally:
+        server.shutdown()
+    return results
+
+
+MICRO_BENCHMARKS = {
+    'detect_function': bench_detect_function,
+    'jieba_cut': bench_jieba_cut,
+    'classify_text': bench_classify_text,
+    'analyze_sentiment': bench_analyze_sentiment,
+    'serialize_jsonify': bench_serialize_jsonify,
+    'serialize_fast_json': bench_serialize_fast_json,
+    'serialize_fast_json_compact': bench_serialize_fast_json_compact,
+    'doubao_chat_stub': bench_doubao_chat,
+    'seq2seq_greedy_decode': bench_seq2seq_greedy_decode,
+    'seq2seq_generate_reply': bench_seq2seq_generate_reply,
+    'train_epoch': bench_train_epoch
+}
+
+
+def git_revision():
+    """当前代码版本"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(current, baseline, tolerance):
+    """与历史结果对比，p95延迟变慢或吞吐量下降超过tolerance时视为回退"""
+    regressions = []
+    if current.get('json_backend') != baseline.get('json_backend'):
+        # 序列化后端不同的两次结果不能直接比较序列化相关的指标
+        print(f"注意：JSON序列化后端不同（{baseline.get('json_backend')} -> {current.get('json_backend')}）", file=sys.stderr)
+
+    def check(name, new, old):
+        if not new or not old or 'p95_ms' not in new or 'p95_ms' not in old:
+            return
+        if new['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {old['p95_ms']:.2f}ms -> {new['p95_ms']:.2f}ms")
+        if new['throughput_per_sec'] < old['throughput_per_sec'] * (1 - tolerance):
+            regressions.append(f"{name}: 吞吐量 {old['throughput_per_sec']:.1f}/s -> {new['throughput_per_sec']:.1f}/s")
+
+    for name, result in current.get('micro', {}).items():
+        check(name, result, baseline.get('micro', {}).get(name))
+    for path, result in current.get('load', {}).items():
+        check(path, result, baseline.get('load', {}).get(path))
+    return regressions
+
+
+def run(args):
+    """执行基准测试，返回结果字典"""
+    os.chdir(BASE_DIR)
+    sys.path.insert(0, BASE_DIR)
+    import fast_json
+    ctx = BenchmarkContext(args)
+    selected = set(args.only.split(',')) if args.only else None
+
+    report = {
+        'timestamp': datetime.datetime.now().isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        # /message、/analyze 响应序列化使用的后端（未安装orjson时为标准库json）
+        'json_backend': fast_json.BACKEND,
+        'config': vars(args),
+        'micro': {},
+        'load': {}
+    }
+    for name, bench in MICRO_BENCHMARKS.items():
+        if selected is not None and name not in selected:
+            continue
+        print(f'[{datetime.datetime.now()}] 运行微基准 {name}...', file=sys.stderr)
+        try:
+            report['micro'][name] = bench(ctx)
+        except Exception as e:
+            report['micro'][name] = {'error': str(e)}
+
+    if selected is None or 'load' in selected:
+        print(f'[{datetime.datetime.now()}] 运行压测场景...', file=sys.stderr)
+        report['load'] = run_load_scenario(ctx)
+
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='智能问答系统性能基准测试')
+    parser.add_argument('--output', default=None, help='结果JSON文件（默认输出到标准输出）')
+    parser.add_argument('--only', default=None, help='只运行指定的基准，逗号分隔（load表示压测场景）')
+    parser.add_argument('--iterations', type=int, default=1000, help='轻量微基准的迭代次数（较重的基准按比例减少）')
+    parser.add_argument('--train-epochs', type=int, default=2, help='训练基准测量的轮数')
+    parser.add_argument('--concurrency', type=int, default=8, help='压测并发数')
+    parser.add_argument('--load-requests', type=int, default=200, help='每个接口的压测请求数')
+    parser.add_argument('--stub-latency-ms', type=float, default=50.0, help='桩服务模拟的上游延迟（毫秒）')
+    parser.add_argument('--seed', type=int, default=42, help='压测请求的随机种子')
+    parser.add_argument('--compare', default=None, help='用于对比的历史结果JSON')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='判定为回退的相对变化阈值')
+    args = parser.parse_args(argv)
+    # 运行时会切换到项目目录，先把文件路径转换为绝对路径
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    # 被测模块的启动日志输出到标准错误，避免混入JSON结果
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f'性能回退: {line}', file=sys.stderr)
+        sys.exit(1 if regressions else 0)
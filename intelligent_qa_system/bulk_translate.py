@@ -0,0 +1,278 @@
+"""
+批量文档翻译模块
+按段落、句子边界把长文档切分成受token预算限制的片段，
+使用有界线程池并发调用豆包API翻译，再按原顺序拼接
+"""
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from text_utils import estimate_tokens
+
+
+# 段落分隔（保留原始换行，便于拼接时还原版式）
+PARAGRAPH_SPLIT_PATTERN = re.compile(r'(\n\s*\n|\n)')
+# 句子结束符：中文标点直接断句，英文句点后需跟空白或位于结尾
+SENTENCE_END_PATTERN = re.compile(r'([。！？；!?;…]+[”’"\'）)]*|\.(?=\s|$)[”’"\'）)]*)\s*')
+
+
+def split_sentences(paragraph):
+    """按句子边界切分段落，切分结果直接拼接可还原原段落"""
+    sentences = []
+    start = 0
+    for match in SENTENCE_END_PATTERN.finditer(paragraph):
+        end = match.end()
+        if end > start:
+            sentences.append(paragraph[start:end])
+            start = end
+    if start < len(paragraph):
+        sentences.append(paragraph[start:])
+    return [s for s in sentences if s.strip()]
+
+
+def _split_long_sentence(sentence, max_tokens):
+    """单句超过预算时按字符硬切分"""
+    pieces = []
+    current = ''
+    for char in sentence:
+        if current and estimate_tokens(current + char) > max_tokens:
+            pieces.append(current)
+            current = ''
+        current += char
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def chunk_paragraph(paragraph, max_tokens):
+    """把段落内的句子贪心打包成不超过max_tokens的片段"""
+    chunks = []
+    current = ''
+    current_tokens = 0
+    for sentence in split_sentences(paragraph):
+        sentence_tokens = estimate_tokens(sentence)
+        if sentence_tokens > max_tokens:
+            if current.strip():
+                chunks.append(current.strip())
+            current, current_tokens = '', 0
+            chunks.extend(p.strip() for p in _split_long_sentence(sentence, max_tokens) if p.strip())
+            continue
+        if current and current_tokens + sentence_tokens > max_tokens:
+            chunks.append(current.strip())
+            current, current_tokens = '', 0
+        current += sentence
+        current_tokens += sentence_tokens
+    if current.strip():
+        chunks.append(current.strip())
+    return chunks
+
+
+def chunk_document(text, max_tokens=800):
+    """
+    切分文档
+    返回 [(段落片段列表, 段落后的分隔符), ...]，空段落的片段列表为空
+    """
+    parts = PARAGRAPH_SPLIT_PATTERN.split(text)
+    layout = []
+    # re.split带捕获组时，奇数位置是分隔符
+    for i in range(0, len(parts), 2):
+        separator = parts[i + 1] if i + 1 < len(parts) else ''
+        layout.append((chunk_paragraph(parts[i], max_tokens), separator))
+    return layout
+
+
+class TranslationQueueFull(Exception):
+    """待翻译片段数达到上限，拒绝新任务"""
+
+    def __init__(self, requested, pending, limit, retry_after=1.0):
+        self.requested = requested
+        self.pending = pending
+        self.limit = limit
+        self.retry_after = retry_after
+        super().__init__(f'待翻译片段过多（{pending}/{limit}），本次需要 {requested} 个')
+
+    @property
+    def too_large(self):
+        """单个任务的片段数就超过上限，重试也无法提交"""
+        return self.requested > self.limit
+
+
+class TranslationJob:
+    """批量翻译任务，记录切分结构、进度和结果"""
+
+    def __init__(self, documents, target_lang, max_tokens):
+        self.job_id = uuid.uuid4().hex
+        self.target_lang = target_lang
+        self.documents = documents
+        self.layouts = [chunk_document(doc, max_tokens) for doc in documents]
+        # 译文与layout结构一一对应，失败的片段保留原文（记录在errors中）
+        self.translations = [[list(chunks) for chunks, _ in layout] for layout in self.layouts]
+        self.total_chunks = sum(len(chunks) for layout in self.layouts for chunks, _ in layout)
+        self.completed_chunks = 0
+        self.failed_chunks = 0
+        self.errors = []
+        self.created_at = time.time()
+        self.finished_at = None
+        self.status = 'running' if self.total_chunks else 'done'
+        if not self.total_chunks:
+            self.finished_at = self.created_at
+        self._lock = threading.Lock()
+        self._done_event = threading.Event()
+        if self.status == 'done':
+            self._done_event.set()
+
+    def record(self, doc_idx, para_idx, chunk_idx, result):
+        """记录单个片段的翻译结果"""
+        with self._lock:
+            if result['success']:
+                self.translations[doc_idx][para_idx][chunk_idx] = result['translated']
+            else:
+                self.failed_chunks += 1
+                self.errors.append({
+                    'document': doc_idx,
+                    'paragraph': para_idx,
+                    'chunk': chunk_idx,
+                    'original': self.translations[doc_idx][para_idx][chunk_idx],
+                    'error': result['translated']
+                })
+            self.completed_chunks += 1
+            if self.completed_chunks == self.total_chunks:
+                # done：全部翻译成功；partial：部分片段失败，译文中保留了这些片段的原文；failed：全部失败
+                if not self.failed_chunks:
+                    self.status = 'done'
+                elif self.failed_chunks < self.total_chunks:
+                    self.status = 'partial'
+                else:
+                    self.status = 'failed'
+                self.finished_at = time.time()
+                self._done_event.set()
+
+    @property
+    def finished(self):
+        return self.status != 'running'
+
+    def wait(self, timeout=None):
+        """等待任务完成"""
+        return self._done_event.wait(timeout)
+
+    def assemble(self, doc_idx):
+        """按原顺序拼接文档译文"""
+        joiner = ' ' if self.target_lang == 'en' else ''
+        parts = []
+        for (_, separator), translated in zip(self.layouts[doc_idx], self.translations[doc_idx]):
+            parts.append(joiner.join(translated))
+            parts.append(separator)
+        return ''.join(parts)
+
+    def to_dict(self, include_results=True):
+        """任务状态（完成后附带译文）"""
+        with self._lock:
+            progress = self.completed_chunks / self.total_chunks if self.total_chunks else 1.0
+            result = {
+                'job_id': self.job_id,
+                'status': self.status,
+                'target_lang': self.target_lang,
+                'documents': len(self.documents),
+                'total_chunks': self.total_chunks,
+                'completed_chunks': self.completed_chunks,
+                'failed_chunks': self.failed_chunks,
+                'progress': progress,
+                'elapsed': (self.finished_at or time.time()) - self.created_at
+            }
+            if include_results and self.finished:
+                failed_documents = {error['document'] for error in self.errors}
+                result['results'] = [
+                    {
+                        'original': doc,
+                        'translated': self.assemble(i),
+                        'target_lang': self.target_lang,
+                        # False表示译文中有未翻译的原文片段（见errors）
+                        'complete': i not in failed_documents
+                    }
+                    for i, doc in enumerate(self.documents)
+                ]
+                result['errors'] = list(self.errors)
+        return result
+
+
+class BulkTranslator:
+    """批量翻译调度器，所有任务共享一个有界线程池以限制上游并发"""
+
+    def __init__(self, doubao, max_workers=4, max_chunk_tokens=800, max_jobs=100, max_pending_chunks=2000):
+        '''
+        max_workers: 并发调用豆包API的线程数
+        max_chunk_tokens: 每个片段的token上限
+        max_jobs: 最多保留的任务数（超出时淘汰最早完成的任务）
+        max_pending_chunks: 线程池中最多排队和执行中的片段数，超出时拒绝新任务
+        '''
+        self.doubao = doubao
+        self.max_workers = max_workers
+        self.max_chunk_tokens = max_chunk_tokens
+        self.max_jobs = max_jobs
+        self.max_pending_chunks = max_pending_chunks
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bulk-translate')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending_chunks = 0
+        # 单个片段翻译耗时的指数滑动平均（秒），用于估算Retry-After
+        self._chunk_seconds = 1.0
+
+    def submit(self, documents, target_lang='en'):
+        """提交批量翻译任务，立即返回任务对象；待翻译片段数超过上限时抛出TranslationQueueFull"""
+        job = TranslationJob(documents, target_lang, self.max_chunk_tokens)
+        with self._lock:
+            if job.total_chunks and self._pending_chunks + job.total_chunks > self.max_pending_chunks:
+                # 腾出足够名额需要完成的片段数 / 并发数 * 每个片段的平均耗时
+                excess = self._pending_chunks + job.total_chunks - self.max_pending_chunks
+                retry_after = excess / self.max_workers * self._chunk_seconds
+                raise TranslationQueueFull(job.total_chunks, self._pending_chunks, self.max_pending_chunks,
+                                           max(1.0, retry_after))
+            self._pending_chunks += job.total_chunks
+            self._jobs[job.job_id] = job
+            self._evict_finished_jobs()
+
+        for doc_idx, layout in enumerate(job.layouts):
+            for para_idx, (chunks, _) in enumerate(layout):
+                for chunk_idx, chunk in enumerate(chunks):
+                    self.executor.submit(self._translate_chunk, job, doc_idx, para_idx, chunk_idx, chunk)
+        return job
+
+    def translate_documents(self, documents, target_lang='en', timeout=None):
+        """同步翻译多篇文档"""
+        job = self.submit(documents, target_lang)
+        job.wait(timeout)
+        return job.to_dict()
+
+    def pending_chunks(self):
+        """排队和执行中的片段数"""
+        with self._lock:
+            return self._pending_chunks
+
+    def get_job(self, job_id):
+        """查询任务"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _translate_chunk(self, job, doc_idx, para_idx, chunk_idx, chunk):
+        """翻译单个片段"""
+        start = time.time()
+        try:
+            result = self.doubao.translate(chunk, job.target_lang)
+        except Exception as e:
+            result = {'success': False, 'translated': f'翻译失败：{str(e)}'}
+        with self._lock:
+            self._pending_chunks -= 1
+            self._chunk_seconds = 0.9 * self._chunk_seconds + 0.1 * (time.time() - start)
+        job.record(doc_idx, para_idx, chunk_idx, result)
+
+    def _evict_finished_jobs(self):
+        """任务数超过上限时淘汰最早完成的任务"""
+        if len(self._jobs) <= self.max_jobs:
+            return
+        for job_id in [jid for jid, job in self._jobs.items() if job.finished]:
+            if len(self._jobs) <= self.max_jobs:
+                break
+            del self._jobs[job_id]
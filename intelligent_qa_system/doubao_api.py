@@ -8,29 +8,43 @@ import json
 class DoubaoAPI:
     """豆包API调用类"""
     
-    def __init__(self, api_key, model_name):
+    def __init__(self, api_key, model_name, host="ark.cn-beijing.volces.com", port=None, use_https=True):
         self.api_key = api_key
         self.model_name = model_name
-        self.host = "ark.cn-beijing.volces.com"
+        self.host = host
+        self.port = port
+        self.use_https = use_https
         self.endpoint = "/api/v3/chat/completions"
     
-    def chat(self, user_message, system_message="你是一个智能助手，可以帮助用户回答问题、分析文本、进行翻译等任务。"):
-        """调用豆包API进行对话"""
+    def _connect(self):
+        """创建到API服务的连接（use_https为False时用于连接本地测试服务）"""
+        if self.use_https:
+            return http.client.HTTPSConnection(self.host, self.port)
+        return http.client.HTTPConnection(self.host, self.port)
+    
+    def chat(self, user_message, system_message="你是一个智能助手，可以帮助用户回答问题、分析文本、进行翻译等任务。", history=None):
+        """
+        调用豆包API进行对话
+        history: 之前的对话消息列表（[{'role': ..., 'content': ...}, ...]），插入在系统消息和本轮用户消息之间
+        """
         conn = None
         try:
-            conn = http.client.HTTPSConnection(self.host)
+            conn = self._connect()
+            messages = [
+                {
+                    "role": "system",
+                    "content": system_message
+                }
+            ]
+            if history:
+                messages.extend(history)
+            messages.append({
+                "role": "user",
+                "content": user_message
+            })
             payload = json.dumps({
                 "model": self.model_name,
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": system_message
-                    },
-                    {
-                        "role": "user",
-                        "content": user_message
-                    }
-                ]
+                "messages": messages
             })
             headers = {
                 'Authorization': f'Bearer {self.api_key}',
@@ -65,23 +79,28 @@ class DoubaoAPI:
             if conn:
                 conn.close()
     
+    def build_translate_prompt(self, text, target_lang='en'):
+        """构造翻译提示词"""
+        if target_lang == 'en':
+            return f"请将以下中文翻译成英文：{text}"
+        return f"Please translate the following English to Chinese: {text}"
+    
     def translate(self, text, target_lang='en'):
         """使用豆包API进行翻译"""
-        if target_lang == 'en':
-            prompt = f"请将以下中文翻译成英文：{text}"
-        else:
-            prompt = f"Please translate the following English to Chinese: {text}"
+        prompt = self.build_translate_prompt(text, target_lang)
         
         result = self.chat(prompt, "你是一个专业的翻译助手。")
         if result['success']:
             return {
                 'original': text,
                 'translated': result['reply'],
-                'target_lang': target_lang
+                'target_lang': target_lang,
+                'success': True
             }
         else:
             return {
                 'original': text,
                 'translated': f'翻译失败：{result.get("error", "未知错误")}',
-                'target_lang': target_lang
+                'target_lang': target_lang,
+                'success': False
             }
@@ -1,6 +1,15 @@
 import os
+import sys
+import json
+import time
+import socket
+import argparse
 import datetime
-from Seq2Seq import Encoder, Decoder
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from Seq2Seq import Encoder, Decoder, greedy_decode
+from vocab import Vocab, SPECIAL_TOKEN_IDS
 import tensorflow as tf
 import typing
 
@@ -12,37 +21,39 @@ batch_size = 15  # 每批次样本数
 embedding_dim = 256  # 词嵌入维度
 hidden_dim = 512  # 隐层神经元个数
 shuffle_buffer_size = 4  # 清洗数据集时将缓冲的实例数
-device = -1  # 使用的设备ID，-1即不使用GPU
 checkpoint_path = 'tmp/model'  # 模型参数保存的路径
+save_every = 10  # 每隔多少轮保存一次模型参数
+max_to_keep = 5  # 保留最近的检查点个数
+# 留作验证集的问答对比例；对话语料是需要逐条记住的问答，留出的问答对不参与训练，本地生成将无法回答，因此默认不留出
+validation_split = 0.0
+patience = 20  # 验证集损失连续多少轮没有下降时提前停止
 MAX_LENGTH = 50  # 句子的最大词长
-CONST = {'_BOS': 0, '_EOS': 1, '_PAD': 2, '_UNK': 3}# 最大输出句子的长度
+CONST = SPECIAL_TOKEN_IDS  # 特殊标记及其id
 
 # 代码11-4 加载词典、数据
 # 加载词典
-print(f'[{datetime.datetime.now()}] 加载词典...')
-data_path = 'data/ids'
-CONST = {'_BOS': 0, '_EOS': 1, '_PAD': 2, '_UNK': 3}
-table = tf.lookup.StaticHashTable(  # 初始化后即不可变的通用哈希表。
-    initializer=tf.lookup.TextFileInitializer(
-        os.path.join(data_path, 'all_dict.txt'),
-        tf.string,
-        tf.lookup.TextFileIndex.WHOLE_LINE,
-        tf.int64,
-        tf.lookup.TextFileIndex.LINE_NUMBER
-    ),  # 要使用的表初始化程序。有关支持的键和值类型，请参见HashTable内核。
-    default_value=CONST['_UNK'] - len(CONST)  # 表中缺少键时使用的值。
-)
-
-# 加载数据
-print(f'[{datetime.datetime.now()}] 加载预处理后的数据...')
+def load_vocab(data_path: str = data_path) -> Vocab:
+    '''
+    data_path: 词典所在的路径
+    '''
+    print(f'[{datetime.datetime.now()}] 加载词典...')
+    return Vocab.load(os.path.join(data_path, 'all_dict.txt'))
+
+def load_table(data_path: str = data_path) -> tf.lookup.StaticHashTable:
+    '''
+    data_path: 词典所在的路径
+    返回词 -> id的哈希表（id已包含特殊标记的偏移，未登录词映射为_UNK）
+    '''
+    return load_vocab(data_path).as_tf_table()
 
 # 构造序列化的键值对字典
-def to_tmp(text):
+def to_tmp(text, table):
     '''
     text: 文本
+    table: 词典哈希表
     '''
     tokenized = tf.strings.split(tf.reshape(text, [1]), sep=' ')
-    tmp = table.lookup(tokenized.values) + len(CONST)
+    tmp = table.lookup(tokenized.values)
     return tmp
 
 # 增加开始和结束标记
@@ -58,59 +69,110 @@ def get_dataset(src_path: str, table: tf.lookup.StaticHashTable) -> tf.data.Data
     '''
     src_path: 文件路径
     table:初始化后不可变的通用哈希表。
-    
+
     '''
     dataset = tf.data.TextLineDataset(src_path)
-    dataset = dataset.map(to_tmp)
+    dataset = dataset.map(lambda text: to_tmp(text, table))
     dataset = dataset.map(add_start_end_tokens)
     return dataset
 
-# 获取数据
-src_train = get_dataset(os.path.join(data_path, 'source.txt'), table)
-tgt_train = get_dataset(os.path.join(data_path, 'target.txt'), table)
-
-# 代码11-5 数据准备
-# 把数据和特征构造为tf数据集
-train_dataset = tf.data.Dataset.zip((src_train, tgt_train))
-
 # 过滤数据实例数
 def filter_instance_by_max_length(src: tf.Tensor, tgt: tf.Tensor) -> tf.Tensor:
     '''
     src: 特征
-    tgt: 标签 
+    tgt: 标签
     '''
     return tf.logical_and(tf.size(src) <= MAX_LENGTH, tf.size(tgt) <= MAX_LENGTH)
 
-train_dataset = train_dataset.filter(filter_instance_by_max_length)  # 过滤数据
-train_dataset = train_dataset.shuffle(shuffle_buffer_size)  # 打乱数据
-train_dataset = train_dataset.padded_batch(  # 将数据长度变为一致，长度不足用_PAD补齐
-    batch_size,
-    padded_shapes=([MAX_LENGTH + 2], [MAX_LENGTH + 2]),
-    padding_values=(CONST['_PAD'], CONST['_PAD']),
-    drop_remainder=True,
-)
-# 提升产生下一个批次数据的效率
-train_dataset = train_dataset.prefetch(tf.data.experimental.AUTOTUNE) 
+# 代码11-5 数据准备
+# 加载问答对
+def load_pairs(table: tf.lookup.StaticHashTable, data_path: str = data_path) -> tf.data.Dataset:
+    '''
+    table: 词典哈希表
+    data_path: 预处理后数据所在的路径
+    '''
+    # 加载数据
+    print(f'[{datetime.datetime.now()}] 加载预处理后的数据...')
+    src_train = get_dataset(os.path.join(data_path, 'source.txt'), table)
+    tgt_train = get_dataset(os.path.join(data_path, 'target.txt'), table)
+
+    # 把数据和特征构造为tf数据集
+    pairs = tf.data.Dataset.zip((src_train, tgt_train))
+    return pairs.filter(filter_instance_by_max_length)  # 过滤数据
+
+# 把问答对打乱、补齐并分批
+def batch_pairs(pairs: tf.data.Dataset, batch_size: int = batch_size, shuffle_buffer_size: int = shuffle_buffer_size,
+                repeat: bool = False, drop_remainder: bool = True) -> tf.data.Dataset:
+    '''
+    pairs: 问答对数据集
+    batch_size: 每批次样本数（多副本训练时为全局批次大小）
+    shuffle_buffer_size: 清洗数据集时将缓冲的实例数，0表示不打乱
+    repeat: 是否无限重复数据集（按固定步数训练时使用）
+    drop_remainder: 是否丢弃最后不足一个批次的数据
+    '''
+    if shuffle_buffer_size:
+        pairs = pairs.shuffle(shuffle_buffer_size)  # 打乱数据
+    if repeat:
+        pairs = pairs.repeat()
+    pairs = pairs.padded_batch(  # 将数据长度变为一致，长度不足用_PAD补齐
+        batch_size,
+        padded_shapes=([MAX_LENGTH + 2], [MAX_LENGTH + 2]),
+        padding_values=(CONST['_PAD'], CONST['_PAD']),
+        drop_remainder=drop_remainder,
+    )
+    # 提升产生下一个批次数据的效率
+    return pairs.prefetch(tf.data.experimental.AUTOTUNE)
+
+def build_dataset(table: tf.lookup.StaticHashTable, data_path: str = data_path,
+                  batch_size: int = batch_size, shuffle_buffer_size: int = shuffle_buffer_size,
+                  repeat: bool = False) -> tf.data.Dataset:
+    '''
+    table: 词典哈希表
+    data_path: 预处理后数据所在的路径
+    batch_size: 每批次样本数（多副本训练时为全局批次大小）
+    shuffle_buffer_size: 清洗数据集时将缓冲的实例数
+    repeat: 是否无限重复数据集（按固定步数训练时使用）
+    '''
+    return batch_pairs(load_pairs(table, data_path), batch_size, shuffle_buffer_size, repeat)
+
+# 划分训练集和验证集
+def build_datasets(table: tf.lookup.StaticHashTable, data_path: str = data_path,
+                   batch_size: int = batch_size, shuffle_buffer_size: int = shuffle_buffer_size,
+                   repeat: bool = False, validation_split: float = validation_split
+                   ) -> typing.Tuple[tf.data.Dataset, typing.Optional[tf.data.Dataset]]:
+    '''
+    validation_split: 留作验证集的问答对比例，按文件顺序取末尾的问答对，保证每次划分一致
+    返回 (训练集, 验证集)，validation_split为0时验证集为None
+    '''
+    pairs = load_pairs(table, data_path)
+    total = sum(1 for _ in pairs)
+    num_val = int(total * validation_split)
+    if validation_split > 0:
+        num_val = max(1, num_val)
+    if not num_val:
+        return batch_pairs(pairs, batch_size, shuffle_buffer_size, repeat), None
+    train_pairs = pairs.take(total - num_val)
+    val_pairs = pairs.skip(total - num_val)
+    print(f'[{datetime.datetime.now()}] 训练集: {total - num_val} 对 验证集: {num_val} 对')
+    return (batch_pairs(train_pairs, batch_size, shuffle_buffer_size, repeat),
+            batch_pairs(val_pairs, batch_size, 0, drop_remainder=False).cache())
 
-# 代码11-6 模型的参数设置
-# 模型参数保存的路径如果不存在则新建
-if not os.path.exists(checkpoint_path):
-    os.makedirs(checkpoint_path)
-    
 # 代码11-11 构建模型
 # 建模
-print(f'[{datetime.datetime.now()}] 创建一个seq2seq模型...')
-encoder = Encoder(table.size().numpy() + len(CONST), embedding_dim, hidden_dim)
-decoder = Decoder(table.size().numpy() + len(CONST), embedding_dim, hidden_dim)
-
-# 代码11-12 构建优化器
-# 设置优化器
-print(f'[{datetime.datetime.now()}] 准备优化器...')
-optimizer = tf.keras.optimizers.Adam()
+def build_model(vocab_size: int) -> typing.Tuple[Encoder, Decoder]:
+    '''
+    vocab_size: 词库大小（含特殊标记）
+    '''
+    print(f'[{datetime.datetime.now()}] 创建一个seq2seq模型...')
+    encoder = Encoder(vocab_size, embedding_dim, hidden_dim)
+    decoder = Decoder(vocab_size, embedding_dim, hidden_dim)
+    # 先用空输入调用一次以创建变量，使变量在分布式策略的作用域内创建
+    enc_output, enc_hidden = encoder(tf.zeros([1, MAX_LENGTH + 2], dtype=tf.int32))
+    decoder(tf.zeros([1, 1], dtype=tf.int32), enc_hidden, enc_output)
+    return encoder, decoder
 
 # 代码11-13 损失函数
 # 设置损失函数
-print(f'[{datetime.datetime.now()}] 设置损失函数...')
 # 损失值计算方式
 loss_object = tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True, reduction='none')
 # 损失函数
@@ -126,114 +188,530 @@ def loss_function(loss_object, real: tf.Tensor, pred: tf.Tensor) -> tf.Tensor:
     mask = tf.math.logical_not(tf.math.equal(real, CONST['_PAD']))
     # 数据格式转换为跟损失值一致
     mask = tf.cast(mask, dtype=loss_.dtype)
-    
-    return tf.reduce_mean(loss_ * mask)  # 返回平均误差
-    
 
-# 代码11-14 保存模型参数    
-# 设置模型保存
-checkpoint = tf.train.Checkpoint(optimizer=optimizer, encoder=encoder, decoder=decoder)
+    return tf.reduce_mean(loss_ * mask)  # 返回平均误差
 
 # 代码11-15 设置训练步
 # 训练
-def train_step(src: tf.Tensor, tgt: tf.Tensor):
+def make_train_step(encoder: Encoder, decoder: Decoder, optimizer: tf.keras.optimizers.Optimizer,
+                    strategy: tf.distribute.Strategy = None, accum_steps: int = 1,
+                    use_function: bool = None):
     '''
-    src: 输入的文本
-    tgt: 标签
+    encoder: 编码器
+    decoder: 解码器
+    optimizer: 优化器
+    strategy: 分布式策略，为None时使用默认（单副本）策略
+    accum_steps: 梯度累积步数，每累积accum_steps个批次的梯度更新一次权重
+    use_function: 是否把训练步编译为图执行，为None时多副本才编译
+    返回训练步函数train_step(src, tgt)，其flush()方法用于应用尚未凑满accum_steps的累积梯度
     '''
-    # 获取标签维度
-    tgt_width, tgt_length = tgt.shape
-    loss = 0
-    # 创建梯度带，用于反向计算导数
-    with tf.GradientTape() as tape:
-        # 对输入的文本编码
-        enc_output, enc_hidden = encoder(src)
-        # 设置解码的神经元数目与编码的神经元数目相等
-        dec_hidden = enc_hidden
-        # 根据标签对数据解码
-        for t in range(tgt_length - 1):
-            # 更新维度，新增1维
-            dec_input = tf.expand_dims(tgt[:, t], 1)
-            # 解码
-            predictions, dec_hidden, dec_out = decoder(dec_input, dec_hidden, enc_output)
-            # 计算损失值
-            loss += loss_function(loss_object, tgt[:, t + 1], predictions)
-    # 计算一次训练的平均损失值
-    batch_loss = loss / tgt_length
-    # 更新预测值
+    strategy = strategy or tf.distribute.get_strategy()
     variables = encoder.trainable_variables + decoder.trainable_variables
-    # 反向求导
-    gradients = tape.gradient(loss, variables)
-    # 利用优化器更新权重
-    optimizer.apply_gradients(zip(gradients, variables))
+    with strategy.scope():
+        # 优化器状态需在副本上下文之外创建
+        if hasattr(optimizer, 'build'):
+            optimizer.build(variables)
+        # 每个副本各自累积本地梯度
+        accumulators = [
+            tf.Variable(tf.zeros_like(v), trainable=False,
+                        synchronization=tf.VariableSynchronization.ON_READ,
+                        aggregation=tf.VariableAggregation.SUM)
+            for v in variables
+        ] if accum_steps > 1 else []
+
+    def replica_step(src: tf.Tensor, tgt: tf.Tensor):
+        '''
+        src: 输入的文本
+        tgt: 标签
+        '''
+        # 获取标签维度
+        tgt_width, tgt_length = tgt.shape
+        loss = 0
+        # 创建梯度带，用于反向计算导数
+        with tf.GradientTape() as tape:
+            # 对输入的文本编码
+            enc_output, enc_hidden = encoder(src)
+            # 设置解码的神经元数目与编码的神经元数目相等
+            dec_hidden = enc_hidden
+            # 根据标签对数据解码
+            for t in range(tgt_length - 1):
+                # 更新维度，新增1维
+                dec_input = tf.expand_dims(tgt[:, t], 1)
+                # 解码
+                predictions, dec_hidden, dec_out = decoder(dec_input, dec_hidden, enc_output)
+                # 计算损失值
+                loss += loss_function(loss_object, tgt[:, t + 1], predictions)
+            # 各副本的梯度会被求和，按副本数和累积步数缩放后等价于在全局批次上求平均
+            scaled_loss = loss / (strategy.num_replicas_in_sync * accum_steps)
+        # 计算一次训练的平均损失值
+        batch_loss = loss / tgt_length
+        # 反向求导
+        gradients = tape.gradient(scaled_loss, variables)
+        if accum_steps > 1:
+            # 累积梯度，凑满accum_steps后再更新
+            for accumulator, gradient in zip(accumulators, gradients):
+                accumulator.assign_add(gradient)
+        else:
+            # 利用优化器更新权重
+            optimizer.apply_gradients(zip(gradients, variables))
+
+        return batch_loss  # 返回每次迭代训练的损失值
+
+    def replica_apply():
+        # 用累积的梯度更新权重并清零
+        optimizer.apply_gradients(zip([tf.identity(a) for a in accumulators], variables))
+        for accumulator in accumulators:
+            accumulator.assign(tf.zeros_like(accumulator))
+
+    def distributed_step(src, tgt):
+        per_replica_loss = strategy.run(replica_step, args=(src, tgt))
+        return strategy.reduce(tf.distribute.ReduceOp.MEAN, per_replica_loss, axis=None)
+
+    def distributed_apply():
+        strategy.run(replica_apply)
 
-    return batch_loss  # 返回每次迭代训练的损失值
+    # 分布式策略下编译为图执行（首轮需要较长的构图时间）；默认策略保持即时执行
+    if use_function is None:
+        use_function = strategy.num_replicas_in_sync > 1
+    if use_function:
+        distributed_step = tf.function(distributed_step)
+        distributed_apply = tf.function(distributed_apply)
 
-# 代码11-16 训练并保存模型	
-print(f'[{datetime.datetime.now()}] 开始训练模型...')
-# 根据设定的训练次数去训练模型
-for ep in range(epoch):
+    pending = [0]
+
+    def flush():
+        if pending[0]:
+            distributed_apply()
+            pending[0] = 0
+
+    def train_step(src, tgt):
+        batch_loss = distributed_step(src, tgt)
+        if accum_steps > 1:
+            pending[0] += 1
+            if pending[0] == accum_steps:
+                flush()
+        return batch_loss
+
+    train_step.flush = flush
+    return train_step
+
+# 训练一轮
+def train_epoch(train_step, train_dataset, steps: int = None) -> tf.Tensor:
+    '''
+    train_step: 训练步函数
+    train_dataset: 训练数据集（可以是分布式数据集）
+    steps: 每轮训练的批次数，为None时遍历整个数据集
+    '''
     # 设置损失值
     total_loss = 0
     # 将每批次的数据取出，放入模型里
     for batch, (src, tgt) in enumerate(train_dataset):
+        if steps is not None and batch >= steps:
+            break
         # 训练并计算损失值
         batch_loss = train_step(src, tgt)
         total_loss += batch_loss
-    if ep % 100 == 0:
-        # 每100训练次保存一次模型
-        checkpoint_prefix = os.path.join(checkpoint_path, 'ckpt')
-        checkpoint.save(file_prefix=checkpoint_prefix)
+    # 应用本轮尚未凑满累积步数的梯度
+    if hasattr(train_step, 'flush'):
+        train_step.flush()
+    return total_loss
 
-    print(f'[{datetime.datetime.now()}] 迭代次数: {ep+1} 损失值: {total_loss:.4f}')
-    
+# 计算验证集损失
+def evaluate(encoder: Encoder, decoder: Decoder, val_dataset: tf.data.Dataset) -> float:
+    '''
+    encoder: 编码器
+    decoder: 解码器
+    val_dataset: 验证数据集
+    返回每个批次的平均损失（与训练损失的计算方式相同，使用真实标签作为解码输入）
+    '''
+    total_loss = 0.0
+    batches = 0
+    for src, tgt in val_dataset:
+        enc_output, enc_hidden = encoder(src)
+        dec_hidden = enc_hidden
+        loss = 0
+        for t in range(tgt.shape[1] - 1):
+            dec_input = tf.expand_dims(tgt[:, t], 1)
+            predictions, dec_hidden, _ = decoder(dec_input, dec_hidden, enc_output)
+            loss += loss_function(loss_object, tgt[:, t + 1], predictions)
+        total_loss += float(loss / tgt.shape[1])
+        batches += 1
+    return total_loss / batches if batches else float('nan')
+
+# 训练状态的检查点
+def training_checkpoint(encoder: Encoder, decoder: Decoder, optimizer: tf.keras.optimizers.Optimizer) \
+        -> typing.Tuple[tf.train.Checkpoint, typing.List[tf.Variable], tf.Variable, tf.Variable, tf.Variable]:
+    '''
+    encoder: 编码器
+    decoder: 解码器
+    optimizer: 优化器（变量已创建）
+    已完成的轮数和早停状态与模型、优化器一起保存，中断后可以从断点继续
+    返回 (检查点, 按固定顺序排列的全部变量, 已完成的轮数, 最佳验证损失, 验证损失未下降的轮数)
+    '''
+    completed_epochs = tf.Variable(0, dtype=tf.int64, trainable=False)
+    best_val_loss = tf.Variable(float('inf'), dtype=tf.float32, trainable=False)
+    bad_epochs = tf.Variable(0, dtype=tf.int64, trainable=False)
+    checkpoint = tf.train.Checkpoint(optimizer=optimizer, encoder=encoder, decoder=decoder,
+                                     epoch=completed_epochs, best_val_loss=best_val_loss, bad_epochs=bad_epochs)
+    optimizer_variables = optimizer.variables() if callable(optimizer.variables) else optimizer.variables
+    variables = (list(encoder.variables) + list(decoder.variables) + list(optimizer_variables)
+                 + [completed_epochs, best_val_loss, bad_epochs])
+    return checkpoint, variables, completed_epochs, best_val_loss, bad_epochs
+
+# 检查点管理器
+def checkpoint_managers(checkpoint: tf.train.Checkpoint, save_path: str, max_to_keep: int) \
+        -> typing.Tuple[tf.train.CheckpointManager, tf.train.CheckpointManager]:
+    '''
+    返回 (最近若干个检查点的管理器, 验证集损失最低的检查点的管理器)
+    '''
+    return (tf.train.CheckpointManager(checkpoint, save_path, max_to_keep=max_to_keep, checkpoint_name='ckpt'),
+            tf.train.CheckpointManager(checkpoint, os.path.join(save_path, 'best'), max_to_keep=1,
+                                       checkpoint_name='ckpt'))
+
+# 后台线程保存检查点
+class AsyncCheckpointWriter:
+    '''
+    训练线程只把变量值复制到内存中的快照，由写线程把快照赋给一组结构相同的影子变量后写入磁盘，
+    训练不必等待磁盘写入；同一时间只有一个保存任务，下一次保存前先等待上一次完成
+    '''
+
+    def __init__(self, vocab_size: int, sources: typing.List[tf.Variable]) -> None:
+        '''
+        vocab_size: 词库大小（含特殊标记），用于构建影子模型
+        sources: training_checkpoint返回的训练变量
+        '''
+        encoder, decoder = build_model(vocab_size)
+        optimizer = tf.keras.optimizers.Adam()
+        optimizer.build(encoder.trainable_variables + decoder.trainable_variables)
+        self.checkpoint, self.shadows, _, _, _ = training_checkpoint(encoder, decoder, optimizer)
+        if len(self.shadows) != len(sources) or any(
+                tuple(a.shape) != tuple(b.shape) for a, b in zip(self.shadows, sources)):
+            raise ValueError('影子检查点与训练状态的结构不一致')
+        self.sources = sources
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint-writer')
+        self._pending = None
+
+    def save(self, managers: typing.List[tf.train.CheckpointManager], checkpoint_number: int) -> None:
+        '''
+        managers: 影子检查点的管理器，快照写入每个管理器的目录
+        checkpoint_number: 检查点编号（已完成的轮数）
+        '''
+        self.sync()
+        values = [v.numpy() for v in self.sources]
+        self._pending = self._executor.submit(self._write, values, managers, checkpoint_number)
+
+    def _write(self, values, managers, checkpoint_number):
+        for shadow, value in zip(self.shadows, values):
+            shadow.assign(value)
+        for manager in managers:
+            manager.save(checkpoint_number=checkpoint_number)
+
+    def sync(self) -> None:
+        '''等待正在进行的保存完成（保存失败时在这里抛出异常）'''
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+    def close(self) -> None:
+        self.sync()
+        self._executor.shutdown()
 
 # 代码11-17 模型预测
 # 模型预测
-def predict(sentence='你好'):
-    # 导入训练参数
-    checkpoint.restore(tf.train.latest_checkpoint(checkpoint_path))
-    # 给句子添加开始和结束标记
-    sentence = '_BOS' + sentence + '_EOS'
-    # 读取字段
-    with open(os.path.join(data_path, 'all_dict.txt'), 'r', encoding='utf-8') as f:
-        all_dict = f.read().split()
-    # 构建: 词-->id的映射字典
-    word2id = {j: i+len(CONST) for i, j in enumerate(all_dict)}
-    word2id.update(CONST)
-    # 构建: id-->词的映射字典
-    id2word = dict(zip(word2id.values(), word2id.keys()))
-    # 分词时保留_EOS 和 _BOS
-    from jieba import lcut, add_word
-    for i in ['_EOS', '_BOS']:
-        add_word(i)
-    # 添加识别不到的词，用_UNK表示
-    inputs = [word2id.get(i, CONST['_UNK']) for i in lcut(sentence)]
-    # 长度填充
-    inputs = tf.keras.preprocessing.sequence.pad_sequences(
-        [inputs], maxlen=MAX_LENGTH, padding='post', value=CONST['_PAD'])
+def predict(encoder: Encoder, decoder: Decoder, sentence='你好', vocab: Vocab = None):
+    '''
+    encoder: 编码器
+    decoder: 解码器
+    sentence: 输入的句子
+    vocab: 词典，为None时从data_path加载
+    '''
+    if vocab is None:
+        vocab = load_vocab(data_path)
+    from jieba import lcut
+    # 分词、添加开始和结束标记并转为id（识别不到的词用_UNK表示），长度不足用_PAD补齐
+    inputs, _ = vocab.encode_batch([lcut(sentence)], max_length=MAX_LENGTH, add_bos_eos=True)
     # 将数据转为tensorflow的数据类型
     inputs = tf.convert_to_tensor(inputs)
-    # 空字符串，用于保留预测结果
-    result = ''
-    
-    # 编码
-    enc_out, enc_hidden = encoder(inputs)
-    dec_hidden = enc_hidden
-    dec_input = tf.expand_dims([word2id['_BOS']], 0)
-
-    for t in range(MAX_LENGTH):
-        # 解码
-        predictions, dec_hidden, attention_weights = decoder(dec_input, dec_hidden, enc_out)
-        # 预测出词语对应的id
-        predicted_id = tf.argmax(predictions[0]).numpy()
-        # 通过字典的映射，用id寻找词，遇到_EOS停止输出
-        if id2word.get(predicted_id, '_UNK') == '_EOS':
+
+    # 编码并逐词解码，遇到_EOS停止输出
+    predicted_ids, _ = greedy_decode(encoder, decoder, inputs, CONST['_BOS'], CONST['_EOS'], MAX_LENGTH)
+    # 未预测出来的词用_UNK替代
+    return ''.join(vocab.decode(predicted_ids))  # 返回预测结果
+
+
+# 配置线程池和CPU逻辑设备（必须在TensorFlow运行时初始化之前调用）
+def configure_runtime(intra_op_threads: int = 0, inter_op_threads: int = 0, num_cpu_devices: int = 1) -> None:
+    '''
+    intra_op_threads: 单个算子内部并行的线程数，0表示由TensorFlow决定
+    inter_op_threads: 算子之间并行的线程数，0表示由TensorFlow决定
+    num_cpu_devices: 把物理CPU划分成的逻辑设备数，用于单机多副本训练
+    '''
+    try:
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+        if num_cpu_devices > 1:
+            cpus = tf.config.list_physical_devices('CPU')
+            tf.config.set_logical_device_configuration(
+                cpus[0], [tf.config.LogicalDeviceConfiguration() for _ in range(num_cpu_devices)])
+    except RuntimeError as e:
+        print(f'[{datetime.datetime.now()}] 运行时已初始化，线程和设备配置未生效: {str(e)}')
+
+# 创建分布式策略
+def get_strategy(name: str = 'default', num_workers: int = 1) -> tf.distribute.Strategy:
+    '''
+    name: default（单副本）、mirrored（单机多CPU副本）或 multi_worker（多进程，读取TF_CONFIG）
+    num_workers: mirrored策略下的副本数
+    '''
+    if name == 'mirrored':
+        devices = [d.name for d in tf.config.list_logical_devices('CPU')][:num_workers]
+        return tf.distribute.MirroredStrategy(devices=devices)
+    if name == 'multi_worker':
+        return tf.distribute.MultiWorkerMirroredStrategy()
+    return tf.distribute.get_strategy()
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+def _strip_option(argv: typing.List[str], option: str) -> typing.List[str]:
+    '''去掉命令行中的某个带值选项'''
+    result = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == option:
+            skip = True
+        elif not arg.startswith(option + '='):
+            result.append(arg)
+    return result
+
+# 在本机启动多个进程进行多worker训练
+def launch_local_workers(num_workers: int, argv: typing.List[str]) -> int:
+    '''
+    num_workers: worker进程数
+    argv: 传给每个worker的命令行参数
+    '''
+    cluster = {'worker': [f'localhost:{_free_port()}' for _ in range(num_workers)]}
+    processes = []
+    for index in range(num_workers):
+        env = dict(os.environ, TF_CONFIG=json.dumps({'cluster': cluster, 'task': {'type': 'worker', 'index': index}}))
+        command = [sys.executable, os.path.abspath(__file__)] + argv + ['--strategy', 'multi_worker']
+        processes.append(subprocess.Popen(command, env=env))
+    return max(p.wait() for p in processes)
+
+# 生成1/2/4/8个CPU副本下的扩展性报告
+def scaling_report(worker_counts: typing.List[int], argv: typing.List[str], report_path: str) -> typing.List[dict]:
+    '''
+    worker_counts: 要测试的副本数
+    argv: 传给每次训练的其余命令行参数
+    report_path: 报告保存路径
+    '''
+    results = []
+    for num_workers in worker_counts:
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            metrics_file = f.name
+        command = [sys.executable, os.path.abspath(__file__)] + argv + [
+            '--strategy', 'mirrored', '--num-workers', str(num_workers),
+            '--metrics-file', metrics_file, '--no-checkpoint', '--no-resume']
+        print(f'[{datetime.datetime.now()}] 扩展性测试: {num_workers} 个CPU副本...')
+        if subprocess.call(command) == 0:
+            with open(metrics_file, 'r', encoding='utf-8') as f:
+                results.append(json.load(f))
+        os.remove(metrics_file)
+
+    base = results[0]['examples_per_sec'] if results else 0
+    for result in results:
+        result['speedup'] = result['examples_per_sec'] / base if base else 0
+        result['efficiency'] = result['speedup'] / result['num_replicas']
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    for result in results:
+        print(f"副本数: {result['num_replicas']} 样本/秒: {result['examples_per_sec']:.1f} "
+              f"加速比: {result['speedup']:.2f} 并行效率: {result['efficiency']:.0%}")
+    return results
+
+def parse_args(argv=None):
+    '''解析命令行参数'''
+    parser = argparse.ArgumentParser(description='训练Seq2Seq对话模型')
+    parser.add_argument('--epochs', type=int, default=epoch, help='迭代训练次数')
+    parser.add_argument('--batch-size', type=int, default=batch_size, help='每个副本的批次样本数')
+    parser.add_argument('--shuffle-buffer-size', type=int, default=shuffle_buffer_size, help='打乱数据的缓冲区大小')
+    parser.add_argument('--steps-per-epoch', type=int, default=None, help='每轮训练的批次数（设置后数据集会重复）')
+    parser.add_argument('--accum-steps', type=int, default=1, help='梯度累积步数，有效批次 = 批次大小 x 副本数 x 累积步数')
+    parser.add_argument('--strategy', default='default', choices=['default', 'mirrored', 'multi_worker'], help='分布式策略')
+    parser.add_argument('--num-workers', type=int, default=1, help='mirrored策略下的CPU副本数')
+    parser.add_argument('--intra-op-threads', type=int, default=0, help='算子内并行线程数（0为自动）')
+    parser.add_argument('--inter-op-threads', type=int, default=0, help='算子间并行线程数（0为自动）')
+    parser.add_argument('--launch-local-workers', type=int, default=0, help='在本机启动N个进程进行multi_worker训练')
+    parser.add_argument('--scaling-report', default=None, help='逗号分隔的副本数（如1,2,4,8），生成扩展性报告')
+    parser.add_argument('--metrics-file', default=None, help='训练结束后写入吞吐量等指标的JSON文件')
+    parser.add_argument('--no-checkpoint', action='store_true', help='不保存模型参数')
+    parser.add_argument('--no-resume', action='store_true', help='忽略已有检查点，从头开始训练')
+    parser.add_argument('--save-every', type=int, default=save_every, help='每隔多少轮保存一次模型参数')
+    parser.add_argument('--max-to-keep', type=int, default=max_to_keep, help='保留最近的检查点个数')
+    parser.add_argument('--validation-split', type=float, default=validation_split, help='留作验证集的问答对比例（0为不验证）')
+    parser.add_argument('--patience', type=int, default=patience, help='验证集损失连续多少轮没有下降时提前停止（0为不提前停止）')
+    parser.add_argument('--min-delta', type=float, default=0.0, help='验证集损失至少下降多少才算改进')
+    parser.add_argument('--sync-save', action='store_true', help='在训练线程中同步保存检查点（默认由后台线程写入）')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+
+    if args.scaling_report:
+        worker_counts = [int(n) for n in args.scaling_report.split(',')]
+        rest = _strip_option(argv, '--scaling-report')
+        if args.steps_per_epoch is None:
+            # 按固定步数测量，保证不同副本数下都有足够的批次
+            rest += ['--steps-per-epoch', '20']
+        if not any(arg.startswith('--epochs') for arg in rest):
+            rest += ['--epochs', '3']
+        scaling_report(worker_counts, rest, os.path.join('tmp', 'scaling_report.json'))
+        return
+    if args.launch_local_workers:
+        sys.exit(launch_local_workers(args.launch_local_workers, _strip_option(argv, '--launch-local-workers')))
+
+    num_cpu_devices = args.num_workers if args.strategy == 'mirrored' else 1
+    configure_runtime(args.intra_op_threads, args.inter_op_threads, num_cpu_devices)
+    strategy = get_strategy(args.strategy, args.num_workers)
+    num_replicas = strategy.num_replicas_in_sync
+    global_batch_size = args.batch_size * num_replicas
+    print(f'[{datetime.datetime.now()}] 分布式策略: {args.strategy} 副本数: {num_replicas} '
+          f'全局批次: {global_batch_size} 梯度累积: {args.accum_steps} '
+          f'有效批次: {global_batch_size * args.accum_steps}')
+
+    vocab = load_vocab(data_path)
+    table = vocab.as_tf_table()
+    train_dataset, val_dataset = build_datasets(table, data_path, global_batch_size, args.shuffle_buffer_size,
+                                                repeat=args.steps_per_epoch is not None,
+                                                validation_split=args.validation_split)
+    if args.strategy == 'multi_worker':
+        # 语料只有一个文件，按数据而不是按文件切分给各worker
+        options = tf.data.Options()
+        options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.DATA
+        train_dataset = train_dataset.with_options(options)
+    # 每轮的批次数，用于计算吞吐量
+    batches_per_epoch = args.steps_per_epoch or sum(1 for _ in train_dataset)
+    train_dataset = strategy.experimental_distribute_dataset(train_dataset)
+
+    # 多worker训练时只有chief（0号worker）把参数保存到正式目录，其余保存到临时目录
+    task = strategy.cluster_resolver.task_id if getattr(strategy, 'cluster_resolver', None) else 0
+    save_path = checkpoint_path if not task else tempfile.mkdtemp()
+
+    # 代码11-6 模型的参数设置
+    # 模型参数保存的路径如果不存在则新建
+    if not os.path.exists(save_path):
+        os.makedirs(save_path)
+
+    with strategy.scope():
+        encoder, decoder = build_model(len(vocab))
+
+        # 代码11-12 构建优化器
+        # 设置优化器
+        print(f'[{datetime.datetime.now()}] 准备优化器...')
+        optimizer = tf.keras.optimizers.Adam()
+    print(f'[{datetime.datetime.now()}] 设置损失函数...')
+
+    train_step = make_train_step(encoder, decoder, optimizer, strategy, args.accum_steps,
+                                 use_function=args.strategy != 'default')
+
+    # 代码11-14 保存模型参数
+    # 设置模型保存：已完成的轮数和早停状态一起保存，中断后可以从断点继续
+    checkpoint, variables, completed_epochs, best_val_loss, bad_epochs = training_checkpoint(encoder, decoder, optimizer)
+    writer = None
+    if not args.no_checkpoint and not args.sync_save:
+        # 由后台线程保存影子检查点，两者的结构相同，保存的检查点可以直接恢复到训练状态
+        writer = AsyncCheckpointWriter(len(vocab), variables)
+        manager, best_manager = checkpoint_managers(writer.checkpoint, save_path, args.max_to_keep)
+    else:
+        manager, best_manager = checkpoint_managers(checkpoint, save_path, args.max_to_keep)
+
+    if not args.no_resume and manager.latest_checkpoint:
+        # 优化器状态已在make_train_step中创建，可以直接恢复
+        checkpoint.restore(manager.latest_checkpoint)
+        print(f'[{datetime.datetime.now()}] 从检查点 {manager.latest_checkpoint} 恢复，'
+              f'已完成 {int(completed_epochs)} 轮，最佳验证损失: {float(best_val_loss):.4f}')
+
+    # 代码11-16 训练并保存模型
+    print(f'[{datetime.datetime.now()}] 开始训练模型...')
+    examples = 0
+    train_seconds = 0.0
+    first_epoch = int(completed_epochs)
+    # 根据设定的训练次数去训练模型
+    for ep in range(first_epoch, args.epochs):
+        start = time.time()
+        total_loss = train_epoch(train_step, train_dataset, args.steps_per_epoch)
+        elapsed = time.time() - start
+        # 第一轮包含图构建时间，不计入吞吐量
+        if ep > first_epoch or args.epochs - first_epoch == 1:
+            train_seconds += elapsed
+            examples += batches_per_epoch * global_batch_size
+        completed_epochs.assign(ep + 1)
+
+        message = f'[{datetime.datetime.now()}] 迭代次数: {ep+1} 损失值: {float(total_loss):.4f} 耗时: {elapsed:.2f}秒'
+        improved = False
+        if val_dataset is not None:
+            val_loss = evaluate(encoder, decoder, val_dataset)
+            improved = val_loss < float(best_val_loss) - args.min_delta
+            if improved:
+                best_val_loss.assign(val_loss)
+                bad_epochs.assign(0)
+            else:
+                bad_epochs.assign_add(1)
+            message += f' 验证损失: {val_loss:.4f}'
+        print(message)
+
+        stop = val_dataset is not None and args.patience and int(bad_epochs) >= args.patience
+        if not args.no_checkpoint:
+            managers = [best_manager] if improved else []
+            # 每save_every轮、提前停止时和最后一轮保存一次模型
+            if (ep + 1) % args.save_every == 0 or stop or ep + 1 == args.epochs:
+                managers.append(manager)
+                # 没有验证集时best与最新检查点保持一致，避免服务端加载之前带验证集训练时留下的旧检查点
+                if val_dataset is None:
+                    managers.append(best_manager)
+            if managers and writer is not None:
+                start = time.time()
+                writer.save(managers, ep + 1)
+                print(f'[{datetime.datetime.now()}] 已提交后台保存检查点，训练等待 {time.time() - start:.3f}秒')
+            else:
+                for target in managers:
+                    target.save(checkpoint_number=ep + 1)
+        if stop:
+            print(f'[{datetime.datetime.now()}] 验证损失连续 {args.patience} 轮没有下降，提前停止训练')
             break
-        # 未预测出来的词用_UNK替代
-        result += id2word.get(predicted_id, '_UNK')
-        dec_input = tf.expand_dims([predicted_id], 0)
 
-    return result # 返回预测结果
+    if writer is not None:
+        # 等待后台保存完成
+        writer.close()
+
+    if args.metrics_file:
+        with open(args.metrics_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                'strategy': args.strategy,
+                'num_replicas': num_replicas,
+                'global_batch_size': global_batch_size,
+                'accum_steps': args.accum_steps,
+                'epochs': args.epochs,
+                'train_seconds': train_seconds,
+                'examples': examples,
+                'examples_per_sec': examples / train_seconds if train_seconds else 0.0,
+                'completed_epochs': int(completed_epochs),
+                'best_val_loss': float(best_val_loss)
+            }, f)
+
+    if not args.no_checkpoint and not task:
+        # 导入训练参数（优先使用验证损失最低的检查点）
+        best_path = tf.train.latest_checkpoint(os.path.join(checkpoint_path, 'best'))
+        checkpoint.restore(best_path or tf.train.latest_checkpoint(checkpoint_path))
+        print('预测示例: \n', predict(encoder, decoder, sentence='你好，在吗', vocab=vocab))
+
 
-print('预测示例: \n', predict(sentence='你好，在吗'))
+if __name__ == '__main__':
+    main()
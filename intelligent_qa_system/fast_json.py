@@ -0,0 +1,51 @@
+"""
+接口响应的JSON序列化
+安装了orjson时使用orjson（直接序列化NumPy数组和标量，输出UTF-8字节），否则退回标准库json
+"""
+import json
+
+import numpy as np
+from flask import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+# 实际使用的序列化后端，基准测试结果中记录该值
+BACKEND = f'orjson {orjson.__version__}' if orjson is not None else 'json'
+
+# 客户端可以通过fields参数选择是否返回的字段
+OPTIONAL_FIELDS = ('text', 'all_probabilities')
+
+
+def _default(obj):
+    """标准库json不支持的NumPy类型"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def dumps(obj):
+    """序列化为UTF-8编码的JSON字节串"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=ORJSON_OPTIONS)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def json_response(obj, status=200):
+    """构造JSON响应（替代jsonify）"""
+    return Response(dumps(obj), status=status, mimetype='application/json')
+
+
+def parse_fields(value):
+    '''
+    解析fields参数（逗号分隔），返回需要返回的可选字段集合
+    未提供时返回全部可选字段，与不带该参数的旧客户端保持一致
+    '''
+    if value is None:
+        return set(OPTIONAL_FIELDS)
+    return {field.strip() for field in value.split(',') if field.strip()}
@@ -4,179 +4,554 @@ NLP模型加载和调用工具类
 """
 import os
 import sys
+import time
+import zlib
+import datetime
+import threading
 import tensorflow as tf
 import numpy as np
 import pandas as pd
 from tensorflow.keras.models import load_model
 from tensorflow.keras.preprocessing import sequence
 import jieba
-from collections import Counter
+from collections import Counter, namedtuple
+from Seq2Seq import greedy_decode
+from vocab import Vocab, BOS_ID, EOS_ID
+
+
+# 文本分类模型快照：模型、字符表、类别和词嵌入矩阵总是一起替换
+TextClassifier = namedtuple('TextClassifier', ['model', 'vocab', 'categories', 'embeddings'])
+
+# 本地Seq2Seq对话模型快照：编码器、解码器（及其编译后的图函数）、词典和检查点路径总是一起替换
+Seq2SeqGenerator = namedtuple('Seq2SeqGenerator',
+                              ['encoder', 'decoder', 'encode', 'decode', 'vocab', 'input_length', 'checkpoint'])
+
+# 模型的一个已加载版本
+ModelVersion = namedtuple('ModelVersion', ['payload', 'version', 'artifacts', 'loaded_at', 'load_seconds', 'warmup_seconds'])
+
+
+class ModelRegistry:
+    """
+    模型注册表：按名称保存每个模型当前的版本
+    新版本在后台线程中加载并预热后整体替换旧版本，
+    替换前已取得旧版本的请求继续使用旧版本直到结束
+    """
+
+    def __init__(self):
+        self._specs = {}
+        self._current = {}
+        self._status = {}
+        self._errors = {}
+        # 最近一次尝试加载时各文件的修改时间，避免对同一组文件反复加载失败
+        self._attempted = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        # 模型名称 -> 版本更新后调用的回调列表
+        self._listeners = {}
+        self._watch_thread = None
+        self._watch_stop = threading.Event()
+
+    def register(self, name, loader, artifacts, warmup=None, label=None):
+        '''
+        name: 模型名称
+        loader: () -> 模型对象，文件不存在时返回None，加载失败时抛出异常
+        artifacts: () -> 模型依赖的文件路径列表，文件修改时间变化时自动重新加载
+        warmup: (模型对象) -> None，替换前用少量推理预热新版本
+        label: 日志中显示的名称
+        '''
+        self._specs[name] = (loader, artifacts, warmup, label or name)
+        self._load_locks[name] = threading.Lock()
+        self._status.setdefault(name, 'unloaded')
+
+    def names(self):
+        return list(self._specs)
+
+    def on_update(self, name, callback):
+        '''
+        注册版本更新回调：模型替换为新版本后调用 callback(版本号)
+        用于让依赖模型输出的数据（如按词嵌入计算的句向量）随模型一起失效
+        '''
+        self._listeners.setdefault(name, []).append(callback)
+
+    def _notify(self, name, version):
+        for callback in self._listeners.get(name, ()):
+            try:
+                callback(version)
+            except Exception as e:
+                print(f"✗ {self._specs[name][3]}版本更新回调失败: {str(e)}")
+
+    def get(self, name):
+        """当前版本的模型对象，未加载时返回None"""
+        current = self._current.get(name)
+        return current.payload if current is not None else None
+
+    def install(self, name, payload, artifacts=None):
+        """直接安装一个已构建好的模型对象（例如测试或基准中使用的模型）"""
+        with self._lock:
+            previous = self._current.get(name)
+            version = previous.version + 1 if previous is not None else 1
+            self._current[name] = ModelVersion(payload, version, artifacts or {}, time.time(), 0.0, 0.0)
+            self._status[name] = 'ready'
+        self._notify(name, version)
+
+    @staticmethod
+    def _mtimes(paths):
+        return {path: os.path.getmtime(path) if os.path.exists(path) else None for path in paths}
+
+    def load(self, name):
+        '''
+        同步加载并预热模型，成功后替换当前版本
+        返回是否加载成功；失败时保留旧版本
+        '''
+        loader, artifacts, warmup, label = self._specs[name]
+        with self._load_locks[name]:
+            mtimes = self._mtimes(artifacts())
+            self._attempted[name] = mtimes
+            self._status[name] = 'loading'
+            start = time.time()
+            try:
+                payload = loader()
+                if payload is None:
+                    self._status[name] = 'ready' if name in self._current else 'unavailable'
+                    return False
+                load_seconds = time.time() - start
+                start = time.time()
+                if warmup is not None:
+                    warmup(payload)
+                warmup_seconds = time.time() - start
+            except Exception as e:
+                self._errors[name] = str(e)
+                self._status[name] = 'ready' if name in self._current else 'failed'
+                print(f"✗ 加载{label}失败: {str(e)}")
+                return False
+
+            with self._lock:
+                previous = self._current.get(name)
+                version = previous.version + 1 if previous is not None else 1
+                # 整体替换为新版本（单次赋值，读取方不会看到半更新的状态）
+                self._current[name] = ModelVersion(payload, version, mtimes, time.time(), load_seconds, warmup_seconds)
+                self._status[name] = 'ready'
+                self._errors.pop(name, None)
+            if previous is not None:
+                print(f"[{datetime.datetime.now()}] ✓ {label}已热更新到版本 {version}"
+                      f"（加载 {load_seconds:.2f}秒，预热 {warmup_seconds:.2f}秒）")
+            self._notify(name, version)
+            return True
+
+    def reload(self, name, wait=False):
+        '''
+        重新加载模型
+        wait: 为False时在后台线程中加载，立即返回
+        返回加载是否成功（后台加载时返回None）
+        '''
+        if name not in self._specs:
+            raise KeyError(name)
+        if wait:
+            return self.load(name)
+        threading.Thread(target=self.load, args=(name,), name=f'reload-{name}', daemon=True).start()
+        return None
+
+    def check_for_updates(self):
+        '''
+        检查各模型的文件是否有变化，有变化的在后台重新加载，返回需要重新加载的模型名称
+        只检查启动时加载过（或尝试加载过）的模型，未启用的模型（如关闭本地生成时的seq2seq）不会被自动加载
+        '''
+        changed = []
+        for name, (_, artifacts, _, _) in list(self._specs.items()):
+            if name not in self._attempted or self._load_locks[name].locked():
+                continue
+            mtimes = self._mtimes(artifacts())
+            if not any(mtimes.values()):
+                continue
+            if mtimes != self._attempted.get(name):
+                changed.append(name)
+                self.reload(name)
+        return changed
+
+    def start_watching(self, interval=10.0):
+        """启动后台线程，每interval秒检查一次模型文件"""
+        if self._watch_thread is not None and self._watch_thread.is_alive():
+            return
+        self._watch_stop.clear()
+
+        def watch():
+            while not self._watch_stop.wait(interval):
+                try:
+                    self.check_for_updates()
+                except Exception as e:
+                    print(f"检查模型文件更新失败: {str(e)}")
+
+        self._watch_thread = threading.Thread(target=watch, name='model-watcher', daemon=True)
+        self._watch_thread.start()
+
+    def stop_watching(self):
+        self._watch_stop.set()
+
+    def info(self, name=None):
+        """各模型的版本、加载时间和状态"""
+        names = [name] if name is not None else self.names()
+        result = {}
+        for model_name in names:
+            current = self._current.get(model_name)
+            item = {
+                'label': self._specs[model_name][3],
+                'status': self._status.get(model_name, 'unloaded'),
+                'version': None,
+                'error': self._errors.get(model_name)
+            }
+            if current is not None:
+                item.update({
+                    'version': current.version,
+                    'loaded_at': datetime.datetime.fromtimestamp(current.loaded_at).isoformat(timespec='seconds'),
+                    'load_seconds': round(current.load_seconds, 3),
+                    'warmup_seconds': round(current.warmup_seconds, 3),
+                    'artifacts': {
+                        path: datetime.datetime.fromtimestamp(mtime).isoformat(timespec='seconds') if mtime else None
+                        for path, mtime in current.artifacts.items()
+                    }
+                })
+            result[model_name] = item
+        return result
 
 
 class NLPModels:
     """NLP模型管理类"""
     
+    # 替换模型前用于预热的样例文本
+    WARMUP_TEXTS = ['今天的比赛非常精彩', '这件衣服质量很好，我很满意']
+    
     def __init__(self):
-        self.text_classifier = None
-        self.sentiment_analyzer_dicts = None
-        self.text_classifier_vocab = None
-        self.text_classifier_categories = None
         # 获取nlp_deeplearn路径（假设在上级目录的兄弟目录）
         current_dir = os.path.dirname(os.path.abspath(__file__))
         parent_dir = os.path.dirname(current_dir)
         self.nlp_deeplearn_path = os.path.join(parent_dir, 'nlp_deeplearn')
+        # Seq2Seq对话模型的词典和检查点（由 execute.py 训练生成）
+        self.seq2seq_vocab_path = os.path.join(current_dir, 'data', 'ids', 'all_dict.txt')
+        self.seq2seq_checkpoint_path = os.path.join(current_dir, 'tmp', 'model')
         
+        # 模型注册表，支持不重启服务热更新模型
+        self.registry = ModelRegistry()
+        self.registry.register('text_classifier', self._load_text_classifier, self._text_classifier_artifacts,
+                               self._warmup_text_classifier, label='文本分类模型')
+        self.registry.register('sentiment_lexicon', self._load_sentiment_lexicon, self._sentiment_artifacts,
+                               label='情感分析词典')
+        self.registry.register('seq2seq', self._load_seq2seq, self._seq2seq_artifacts,
+                               self._warmup_seq2seq, label='Seq2Seq对话模型')
+    
+    @property
+    def text_classifier(self):
+        classifier = self.registry.get('text_classifier')
+        return classifier.model if classifier else None
+    
+    @property
+    def text_classifier_vocab(self):
+        classifier = self.registry.get('text_classifier')
+        return classifier.vocab if classifier else None
+    
+    @property
+    def text_classifier_categories(self):
+        classifier = self.registry.get('text_classifier')
+        return classifier.categories if classifier else None
+    
+    @property
+    def text_classifier_embeddings(self):
+        classifier = self.registry.get('text_classifier')
+        return classifier.embeddings if classifier else None
+    
+    @property
+    def sentiment_analyzer_dicts(self):
+        return self.registry.get('sentiment_lexicon')
+    
+    def _text_classifier_artifacts(self):
+        base_dir = os.path.join(self.nlp_deeplearn_path, 'data')
+        return [os.path.join(base_dir, 'cnews.vocab.txt'), os.path.join(self.nlp_deeplearn_path, 'tmp', 'my_model.h5')]
+    
+    def _sentiment_artifacts(self):
+        data_dir = os.path.join(self.nlp_deeplearn_path, 'data')
+        return [os.path.join(data_dir, name) for name in ('neg.xls', 'pos.xls', 'sum.xls')]
+    
     def load_text_classifier(self):
         """加载文本分类模型"""
-        try:
-            # 路径配置
-            base_dir = os.path.join(self.nlp_deeplearn_path, 'data')
-            vocab_dir = os.path.join(base_dir, 'cnews.vocab.txt')
-            model_dir = os.path.join(self.nlp_deeplearn_path, 'tmp', 'my_model.h5')
-            
-            if not os.path.exists(vocab_dir) or not os.path.exists(model_dir):
-                print(f"文本分类模型文件不存在: vocab={vocab_dir}, model={model_dir}")
-                return False
-            
-            # 读取词汇表
-            with open(vocab_dir, 'r', encoding='utf-8', errors='ignore') as f:
-                words = [i.strip() for i in f.readlines()]
-            self.text_classifier_vocab = dict(zip(words, range(len(words))))
-            
-            # 读取分类目录
-            self.text_classifier_categories = ['体育', '财经', '房产', '家居', '教育', '科技', '时尚', '时政', '游戏', '娱乐']
-            
-            # 加载模型
-            self.text_classifier = load_model(model_dir)
+        if self.registry.load('text_classifier'):
             print("✓ 文本分类模型加载成功")
             return True
-        except Exception as e:
-            print(f"✗ 加载文本分类模型失败: {str(e)}")
-            return False
+        return False
+    
+    def _load_text_classifier(self):
+        """读取文本分类模型文件，返回TextClassifier快照"""
+        # 路径配置
+        vocab_dir, model_dir = self._text_classifier_artifacts()
+        
+        if not os.path.exists(vocab_dir) or not os.path.exists(model_dir):
+            print(f"文本分类模型文件不存在: vocab={vocab_dir}, model={model_dir}")
+            return None
+        
+        # 读取词汇表
+        with open(vocab_dir, 'r', encoding='utf-8', errors='ignore') as f:
+            words = [i.strip() for i in f.readlines()]
+        vocab = dict(zip(words, range(len(words))))
+        
+        # 读取分类目录（元组，每次请求复用同一组类别标签）
+        categories = ('体育', '财经', '房产', '家居', '教育', '科技', '时尚', '时政', '游戏', '娱乐')
+        
+        # 加载模型
+        model = load_model(model_dir)
+        
+        # 取出词嵌入矩阵，供语义缓存计算句向量
+        embeddings = None
+        for layer in model.layers:
+            if isinstance(layer, tf.keras.layers.Embedding):
+                embeddings = layer.get_weights()[0]
+                break
+        return TextClassifier(model, vocab, categories, embeddings)
+    
+    def _warmup_text_classifier(self, classifier):
+        """用样例文本逐条预测（与单条请求的输入形状相同），让新模型在替换前完成图构建"""
+        for text in self.WARMUP_TEXTS:
+            x_pad = sequence.pad_sequences([self._classifier_ids(classifier, text)], maxlen=600)
+            classifier.model.predict(x_pad, verbose=0)
+    
+    def _seq2seq_artifacts(self):
+        # 检查点状态文件在每次保存后更新
+        return [self.seq2seq_vocab_path,
+                os.path.join(self.seq2seq_checkpoint_path, 'best', 'checkpoint'),
+                os.path.join(self.seq2seq_checkpoint_path, 'checkpoint')]
+    
+    def load_seq2seq(self):
+        """加载Seq2Seq对话模型"""
+        if self.registry.load('seq2seq'):
+            print("✓ Seq2Seq对话模型加载成功")
+            return True
+        return False
+    
+    def _load_seq2seq(self):
+        """读取词典和检查点，返回Seq2SeqGenerator快照"""
+        # 优先使用验证损失最低的检查点，没有时使用最新的检查点
+        checkpoint = (tf.train.latest_checkpoint(os.path.join(self.seq2seq_checkpoint_path, 'best'))
+                      or tf.train.latest_checkpoint(self.seq2seq_checkpoint_path))
+        if not os.path.exists(self.seq2seq_vocab_path) or checkpoint is None:
+            print(f"Seq2Seq模型文件不存在: vocab={self.seq2seq_vocab_path}, checkpoint={self.seq2seq_checkpoint_path}")
+            return None
+        
+        # 与训练使用相同的词典和模型结构
+        import execute
+        vocab = Vocab.load(self.seq2seq_vocab_path)
+        encoder, decoder = execute.build_model(len(vocab))
+        # 检查点中还保存了优化器和训练进度，推理时不需要
+        tf.train.Checkpoint(encoder=encoder, decoder=decoder).restore(checkpoint).expect_partial()
+        # 编码器和单步解码编译为图执行，输入补齐到固定长度，每个版本只构建一次图
+        return Seq2SeqGenerator(encoder, decoder, tf.function(encoder), tf.function(decoder),
+                                vocab, execute.MAX_LENGTH, checkpoint)
+    
+    def _warmup_seq2seq(self, generator):
+        """用样例文本生成一次，让新模型在替换前完成图构建"""
+        self._generate(generator, self.WARMUP_TEXTS[0], 2)
     
     def load_sentiment_analyzer(self):
         """加载情感分析词典"""
-        try:
-            # 路径配置
-            data_dir = os.path.join(self.nlp_deeplearn_path, 'data')
-            neg_file = os.path.join(data_dir, 'neg.xls')
-            pos_file = os.path.join(data_dir, 'pos.xls')
-            sum_file = os.path.join(data_dir, 'sum.xls')
-            
-            if not os.path.exists(neg_file) or not os.path.exists(pos_file):
-                print("情感分析数据文件不存在，将使用简化词典")
-                return False
-            
-            # 读取并构建词典
-            neg = pd.read_excel(neg_file, header=None, index_col=None)
-            pos = pd.read_excel(pos_file, header=None, index_col=None)
-            
-            pos['mark'] = 1
-            neg['mark'] = 0
-            pn_all = pd.concat([pos, neg], ignore_index=True)
-            pn_all[0] = pn_all[0].astype(str)
-            
-            # 分词
-            cut_word = lambda x: list(jieba.cut(x))
-            pn_all['words'] = pn_all[0].apply(cut_word)
-            
-            # 如果有sum.xls，也加入
-            if os.path.exists(sum_file):
-                comment = pd.read_excel(sum_file)
-                if 'rateContent' in comment.columns:
-                    comment = comment[comment['rateContent'].notnull()]
-                    comment['words'] = comment['rateContent'].apply(cut_word)
-                    pn_comment = pd.concat([pn_all['words'], comment['words']], ignore_index=True)
-                else:
-                    pn_comment = pn_all['words']
-            else:
-                pn_comment = pn_all['words']
-            
-            # 构建词典
-            w = []
-            for i in pn_comment:
-                w.extend(i)
-            dicts = pd.DataFrame(pd.Series(w).value_counts())
-            dicts['id'] = list(range(1, len(dicts)+1))
-            self.sentiment_analyzer_dicts = dicts
-            
+        if self.registry.load('sentiment_lexicon'):
             print("✓ 情感分析词典构建成功")
             return True
-        except Exception as e:
-            print(f"✗ 加载情感分析词典失败: {str(e)}")
-            return False
+        return False
     
-    def classify_text(self, text):
-        """文本分类"""
-        if not self.text_classifier or not self.text_classifier_vocab:
+    def _load_sentiment_lexicon(self):
+        """读取情感分析数据文件，返回词频词典"""
+        # 路径配置
+        neg_file, pos_file, sum_file = self._sentiment_artifacts()
+        
+        if not os.path.exists(neg_file) or not os.path.exists(pos_file):
+            print("情感分析数据文件不存在，将使用简化词典")
+            return None
+        
+        # 读取并构建词典
+        neg = pd.read_excel(neg_file, header=None, index_col=None)
+        pos = pd.read_excel(pos_file, header=None, index_col=None)
+        
+        pos['mark'] = 1
+        neg['mark'] = 0
+        pn_all = pd.concat([pos, neg], ignore_index=True)
+        pn_all[0] = pn_all[0].astype(str)
+        
+        # 分词
+        cut_word = lambda x: list(jieba.cut(x))
+        pn_all['words'] = pn_all[0].apply(cut_word)
+        
+        # 如果有sum.xls，也加入
+        if os.path.exists(sum_file):
+            comment = pd.read_excel(sum_file)
+            if 'rateContent' in comment.columns:
+                comment = comment[comment['rateContent'].notnull()]
+                comment['words'] = comment['rateContent'].apply(cut_word)
+                pn_comment = pd.concat([pn_all['words'], comment['words']], ignore_index=True)
+            else:
+                pn_comment = pn_all['words']
+        else:
+            pn_comment = pn_all['words']
+        
+        # 构建词典
+        w = []
+        for i in pn_comment:
+            w.extend(i)
+        dicts = pd.DataFrame(pd.Series(w).value_counts())
+        dicts['id'] = list(range(1, len(dicts)+1))
+        return dicts
+    
+    @staticmethod
+    def _classifier_ids(classifier, text):
+        """把文本转换为分类模型的字符id序列"""
+        vocab = classifier.vocab
+        return [vocab[x] for x in text if x in vocab]
+    
+    @staticmethod
+    def _classification_result(classifier, probs, include_probabilities=True):
+        """根据类别概率构造分类结果"""
+        index = int(np.argmax(probs))
+        result = {
+            'category': classifier.categories[index],
+            'confidence': float(probs[index])
+        }
+        if include_probabilities:
+            # tolist()一次性转换为Python浮点数，类别标签复用模型快照中的元组
+            result['all_probabilities'] = dict(zip(classifier.categories, probs.tolist()))
+        return result
+    
+    def classify_text(self, text, include_probabilities=True):
+        """文本分类（include_probabilities为False时不返回各类别的概率）"""
+        # 整个请求使用同一个模型快照，热更新不会影响进行中的请求
+        classifier = self.registry.get('text_classifier')
+        if not classifier or not classifier.vocab:
             return None
         
         try:
             # 预处理
-            contents = list(text)
-            data_id = [[self.text_classifier_vocab.get(x, 0) for x in contents if x in self.text_classifier_vocab]]
-            x_pad = sequence.pad_sequences(data_id, maxlen=600)
+            x_pad = sequence.pad_sequences([self._classifier_ids(classifier, text)], maxlen=600)
             
             # 预测
-            y_pred = self.text_classifier.predict(x_pad, verbose=0)
-            predicted_category = self.text_classifier_categories[np.argmax(y_pred[0])]
-            confidence = float(np.max(y_pred[0]))
-            
-            return {
-                'category': predicted_category,
-                'confidence': confidence,
-                'all_probabilities': {cat: float(prob) for cat, prob in zip(self.text_classifier_categories, y_pred[0])}
-            }
+            y_pred = classifier.model.predict(x_pad, verbose=0)
+            return self._classification_result(classifier, y_pred[0], include_probabilities)
         except Exception as e:
             print(f"文本分类失败: {str(e)}")
             return None
     
+    @staticmethod
+    def _generate(generator, text, max_length):
+        """分词、编码后贪心解码（最多max_length个词），返回回复和置信度"""
+        vocab = generator.vocab
+        inputs, lengths = vocab.encode_batch([jieba.lcut(text)], max_length=generator.input_length, add_bos_eos=True)
+        predicted_ids, log_probs = greedy_decode(generator.encode, generator.decode, tf.convert_to_tensor(inputs),
+                                                 BOS_ID, EOS_ID, max_length)
+        return {
+            'reply': ''.join(vocab.decode(predicted_ids)),
+            # 每个词的平均对数概率，没有生成任何词时为None
+            'mean_log_prob': float(np.mean(log_probs)) if log_probs else None,
+            'unk_ratio': vocab.unk_ratio(predicted_ids),
+            # 去掉开始和结束标记后输入中_UNK的比例
+            'input_unk_ratio': vocab.unk_ratio(inputs[0, 1:lengths[0] - 1])
+        }
+    
+    def generate_reply(self, text, max_length=50):
+        '''
+        用本地Seq2Seq模型生成回复
+        返回 {'reply', 'mean_log_prob', 'unk_ratio', 'input_unk_ratio'}，模型不可用或生成失败时返回None
+        '''
+        generator = self.registry.get('seq2seq')
+        if not generator:
+            return None
+        
+        try:
+            return self._generate(generator, text, max_length)
+        except Exception as e:
+            print(f"本地生成回复失败: {str(e)}")
+            return None
+    
+    def classify_texts(self, texts, batch_size=64, include_probabilities=True):
+        """批量文本分类，整批只调用一次predict"""
+        classifier = self.registry.get('text_classifier')
+        if not classifier or not classifier.vocab:
+            return [None] * len(texts)
+        
+        try:
+            x_pad = sequence.pad_sequences([self._classifier_ids(classifier, text) for text in texts], maxlen=600)
+            y_pred = classifier.model.predict(x_pad, batch_size=batch_size, verbose=0)
+            return [self._classification_result(classifier, probs, include_probabilities) for probs in y_pred]
+        except Exception as e:
+            print(f"批量文本分类失败: {str(e)}")
+            return [None] * len(texts)
+    
+    # 计算句向量时忽略的标点和语气词
+    EMBED_IGNORED_CHARS = frozenset('，。！？、；：,.!?;:"\'“”‘’（）()吗呢吧啊呀')
+    
+    def embed_text(self, text, hash_dim=256):
+        """
+        计算文本的归一化句向量
+        优先对分类模型词嵌入做平均池化；模型不可用时退化为字/二元组哈希向量
+        """
+        classifier = self.registry.get('text_classifier')
+        embeddings = classifier.embeddings if classifier else None
+        vocab = classifier.vocab if classifier else None
+        if embeddings is not None and vocab:
+            ids = [vocab[x] for x in text if x in vocab and x not in self.EMBED_IGNORED_CHARS]
+            if ids:
+                vector = embeddings[ids].mean(axis=0).astype(np.float32)
+            else:
+                vector = np.zeros(embeddings.shape[1], dtype=np.float32)
+        else:
+            vector = np.zeros(hash_dim, dtype=np.float32)
+            chars = [c for c in text.lower() if not c.isspace() and c not in self.EMBED_IGNORED_CHARS]
+            grams = chars + [a + b for a, b in zip(chars, chars[1:])]
+            for gram in grams:
+                vector[zlib.crc32(gram.encode('utf-8')) % hash_dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+    
+    # 扩展的正面词汇表（使用set去重）
+    POSITIVE_WORDS = frozenset({'好', '棒', '喜欢', '满意', '赞', '优秀', '完美', '太好了', '不错', '高兴', 
+                                '开心', '快乐', '愉快', '兴奋', '惊喜', '爱', '美好', 
+                                '精彩', '出色', '杰出', '很棒', '非常好', '太棒了', '好评',
+                                '棒极了'})
+    
+    # 扩展的负面词汇表（使用set去重）
+    NEGATIVE_WORDS = frozenset({'差', '坏', '讨厌', '不满', '糟糕', '失望', '难过', '伤心', '生气', '愤怒', 
+                                '不好', '沮丧', '痛苦', '难受', '厌恶',
+                                '很差', '非常差', '太差了', '差评',
+                                '糟糕透顶', '让人失望'})
+    
+    def _score_sentiment(self, words):
+        """根据分词结果计算情感倾向"""
+        # 统计正面和负面词汇
+        pos_count = sum(1 for word in words if word in self.POSITIVE_WORDS)
+        neg_count = sum(1 for word in words if word in self.NEGATIVE_WORDS)
+        
+        # 计算情感倾向和置信度
+        total_emotion_words = pos_count + neg_count
+        if total_emotion_words == 0:
+            sentiment = '中性'
+            confidence = 0.5
+        elif pos_count > neg_count:
+            sentiment = '正面'
+            confidence = 0.6 + min(0.35, pos_count / 15)
+        elif neg_count > pos_count:
+            sentiment = '负面'
+            confidence = 0.6 + min(0.35, neg_count / 15)
+        else:
+            sentiment = '中性'
+            confidence = 0.5
+        
+        # 确保置信度在合理范围内
+        confidence = min(0.95, max(0.5, confidence))
+        
+        return {
+            'sentiment': sentiment,
+            'confidence': confidence,
+            'positive_words': pos_count,
+            'negative_words': neg_count
+        }
+    
     def analyze_sentiment(self, text):
         """情感分析（基于词典的方法）"""
         try:
             # 分词
-            words = list(jieba.cut(text))
-            
-            # 扩展的正面词汇表（使用set去重）
-            pos_words = {'好', '棒', '喜欢', '满意', '赞', '优秀', '完美', '太好了', '不错', '高兴', 
-                        '开心', '快乐', '愉快', '兴奋', '惊喜', '爱', '美好', 
-                        '精彩', '出色', '杰出', '很棒', '非常好', '太棒了', '好评',
-                        '棒极了'}
-            
-            # 扩展的负面词汇表（使用set去重）
-            neg_words = {'差', '坏', '讨厌', '不满', '糟糕', '失望', '难过', '伤心', '生气', '愤怒', 
-                        '不好', '沮丧', '痛苦', '难受', '厌恶',
-                        '很差', '非常差', '太差了', '差评',
-                        '糟糕透顶', '让人失望'}
-            
-            # 统计正面和负面词汇
-            pos_count = sum(1 for word in words if word in pos_words)
-            neg_count = sum(1 for word in words if word in neg_words)
-            
-            # 计算情感倾向和置信度
-            total_emotion_words = pos_count + neg_count
-            if total_emotion_words == 0:
-                sentiment = '中性'
-                confidence = 0.5
-            elif pos_count > neg_count:
-                sentiment = '正面'
-                confidence = 0.6 + min(0.35, pos_count / 15)
-            elif neg_count > pos_count:
-                sentiment = '负面'
-                confidence = 0.6 + min(0.35, neg_count / 15)
-            else:
-                sentiment = '中性'
-                confidence = 0.5
-            
-            # 确保置信度在合理范围内
-            confidence = min(0.95, max(0.5, confidence))
-            
-            return {
-                'sentiment': sentiment,
-                'confidence': confidence,
-                'positive_words': pos_count,
-                'negative_words': neg_count
-            }
+            return self._score_sentiment(jieba.lcut(text))
         except Exception as e:
             print(f"情感分析失败: {str(e)}")
             return {
@@ -185,3 +560,7 @@ class NLPModels:
                 'positive_words': 0,
                 'negative_words': 0
             }
+    
+    def analyze_sentiments(self, texts):
+        """批量情感分析"""
+        return [self.analyze_sentiment(text) for text in texts]
@@ -0,0 +1,278 @@
+"""
+问答检索索引
+基于jieba分词的BM25倒排索引（可选叠加句向量索引），
+由对话语料和FAQ构建，支持增量添加和持久化，用于在本地直接回答高匹配度的问题
+"""
+import heapq
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import jieba
+import numpy as np
+
+
+# 只由标点和空白组成的token不参与检索
+PUNCTUATION_PATTERN = re.compile(r'^[\s\W_]+$')
+
+
+def tokenize(text):
+    """分词并去掉标点"""
+    return [t.lower() for t in jieba.lcut(text) if not PUNCTUATION_PATTERN.match(t)]
+
+
+def detokenize(line):
+    """还原source.txt/target.txt中以空格分隔的分词结果（原文中的空格会保存为三个空格），去掉UTF-8 BOM"""
+    return line.replace('\ufeff', '').replace('   ', '\0').replace(' ', '').replace('\0', ' ').strip()
+
+
+class RetrievalIndex:
+    """BM25倒排索引 + 可选向量索引"""
+
+    def __init__(self, k1=1.5, b=0.75, embed_fn=None, vector_weight=0.5):
+        '''
+        k1, b: BM25参数
+        embed_fn: 文本 -> 归一化句向量，为None时只使用BM25
+        vector_weight: 向量相似度在综合得分中的权重
+        '''
+        self.k1 = k1
+        self.b = b
+        self.embed_fn = embed_fn
+        self.vector_weight = vector_weight
+        self.questions = []
+        self.answers = []
+        self.doc_lengths = []
+        self.total_length = 0
+        # 倒排表：词 -> {文档id: 词频}
+        self.postings = {}
+        self._question_ids = {}
+        self._idf_cache = {}
+        # 文档id -> 词频，计算文档一侧的归一化得分时按需填充
+        self._doc_terms = {}
+        self._vectors = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.questions)
+
+    def add(self, question, answer):
+        """增量添加问答对，问题已存在时更新答案"""
+        question = question.strip()
+        answer = answer.strip()
+        if not question or not answer:
+            return None
+        with self._lock:
+            doc_id = self._question_ids.get(question)
+            if doc_id is not None:
+                self.answers[doc_id] = answer
+                return doc_id
+
+            tokens = tokenize(question)
+            doc_id = len(self.questions)
+            self.questions.append(question)
+            self.answers.append(answer)
+            self.doc_lengths.append(len(tokens))
+            self.total_length += len(tokens)
+            self._question_ids[question] = doc_id
+            for token in tokens:
+                postings = self.postings.setdefault(token, {})
+                postings[doc_id] = postings.get(doc_id, 0) + 1
+            self._idf_cache.clear()
+            if self.embed_fn is not None:
+                self._append_vector(self.embed_fn(question))
+            return doc_id
+
+    def _append_vector(self, vector):
+        """向量矩阵按倍数扩容，避免每次添加都复制"""
+        count = len(self.questions)
+        if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+            self._vectors = np.zeros((max(64, count), vector.shape[0]), dtype=np.float32)
+            for i, question in enumerate(self.questions[:-1]):
+                self._vectors[i] = self.embed_fn(question)
+        elif count > self._vectors.shape[0]:
+            grown = np.zeros((self._vectors.shape[0] * 2, self._vectors.shape[1]), dtype=np.float32)
+            grown[:self._vectors.shape[0]] = self._vectors
+            self._vectors = grown
+        self._vectors[count - 1] = vector
+
+    def rebuild_vectors(self):
+        """句向量模型更新后重新计算全部问题的向量（新旧向量不在同一空间，不能混合比较）"""
+        if self.embed_fn is None:
+            return
+        with self._lock:
+            questions = list(self.questions)
+        # 在锁外计算，重建期间检索继续使用旧向量
+        vectors = [self.embed_fn(question) for question in questions]
+        with self._lock:
+            # 重建期间新添加的问题
+            vectors.extend(self.embed_fn(question) for question in self.questions[len(vectors):])
+            self._vectors = np.stack(vectors).astype(np.float32) if vectors else None
+
+    def add_pairs_from_ids(self, source_path, target_path):
+        """从data_utils.save生成的source.txt/target.txt添加问答对"""
+        count = 0
+        with open(source_path, 'r', encoding='utf-8') as src, open(target_path, 'r', encoding='utf-8') as tgt:
+            for question, answer in zip(src, tgt):
+                if self.add(detokenize(question.rstrip('\n')), detokenize(answer.rstrip('\n'))) is not None:
+                    count += 1
+        return count
+
+    def add_faq_file(self, path):
+        """
+        从FAQ文件添加问答对
+        每行 "问题<TAB>答案"；没有TAB时按对话语料格式处理（奇数行问题，偶数行答案）
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = [line.rstrip('\n') for line in f if line.strip()]
+        if lines and all('\t' in line for line in lines):
+            pairs = [line.split('\t', 1) for line in lines]
+        else:
+            pairs = zip(lines[::2], lines[1::2])
+        return sum(1 for question, answer in pairs if self.add(question, answer) is not None)
+
+    def _idf(self, token):
+        """逆文档频率（带缓存）"""
+        idf = self._idf_cache.get(token)
+        if idf is None:
+            df = len(self.postings.get(token, ()))
+            n = len(self.questions)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            self._idf_cache[token] = idf
+        return idf
+
+    def _bm25(self, terms, doc_id, avgdl):
+        """文档对一组词（词 -> 词频）的BM25得分"""
+        norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / avgdl
+        return sum(self._idf(token) * tf * (self.k1 + 1) / (tf + self.k1 * norm) for token, tf in terms.items())
+
+    def _doc_self_score(self, doc_id, avgdl):
+        """问题与自身完全匹配时的得分，用于归一化文档一侧的匹配程度"""
+        terms = self._doc_terms.get(doc_id)
+        if terms is None:
+            terms = self._doc_terms[doc_id] = Counter(tokenize(self.questions[doc_id]))
+        return self._bm25(terms, doc_id, avgdl)
+
+    def search(self, query, top_k=1):
+        '''
+        检索最相近的问题
+        返回按得分降序的结果列表，score为归一化到[0, 1]的综合得分
+        BM25得分分别按查询和文档与自身匹配的得分归一化后取较小值，
+        避免很短的通用查询（如“在吗”）因为完全包含在某个问题中而得到高分
+        '''
+        start = time.perf_counter()
+        tokens = tokenize(query)
+        with self._lock:
+            if not tokens or not self.questions:
+                return []
+            avgdl = self.total_length / len(self.questions)
+            scores = {}
+            unique_tokens = set(tokens)
+            # 查询与自身完全相同的文档的得分，用于把BM25得分归一化
+            query_norm = 1 - self.b + self.b * len(tokens) / avgdl
+            max_score = 0.0
+            for token in unique_tokens:
+                idf = self._idf(token)
+                qtf = tokens.count(token)
+                max_score += idf * qtf * (self.k1 + 1) / (qtf + self.k1 * query_norm)
+                for doc_id, tf in self.postings.get(token, {}).items():
+                    norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / avgdl
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+
+            if not scores or max_score <= 0:
+                return []
+            candidates = heapq.nlargest(max(top_k, 5), scores.items(), key=lambda item: item[1])
+
+            vector_scores = None
+            if self.embed_fn is not None and self._vectors is not None:
+                query_vector = self.embed_fn(query)
+                if query_vector.shape[0] == self._vectors.shape[1]:
+                    ids = [doc_id for doc_id, _ in candidates]
+                    vector_scores = dict(zip(ids, (self._vectors[ids] @ query_vector).tolist()))
+
+            results = []
+            for doc_id, bm25 in candidates:
+                doc_score = self._doc_self_score(doc_id, avgdl)
+                bm25_score = min(1.0, bm25 / max_score, bm25 / doc_score if doc_score > 0 else 0.0)
+                score = bm25_score
+                if vector_scores is not None:
+                    score = (1 - self.vector_weight) * bm25_score + self.vector_weight * vector_scores[doc_id]
+                results.append({
+                    'question': self.questions[doc_id],
+                    'answer': self.answers[doc_id],
+                    'score': score,
+                    'bm25': bm25_score
+                })
+        results.sort(key=lambda item: item['score'], reverse=True)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        for item in results:
+            item['elapsed_ms'] = elapsed_ms
+        return results[:top_k]
+
+    def save(self, path):
+        """持久化到JSON文件（原子写入）"""
+        with self._lock:
+            data = {
+                'k1': self.k1,
+                'b': self.b,
+                'questions': self.questions,
+                'answers': self.answers,
+                'doc_lengths': self.doc_lengths,
+                'postings': {token: {str(k): v for k, v in docs.items()} for token, docs in self.postings.items()}
+            }
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        # 每次写入使用独立的临时文件，并发保存时不会互相覆盖
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory or '.')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path, embed_fn=None, vector_weight=0.5):
+        """从JSON文件加载索引（向量索引按需重新计算）"""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        index = cls(data['k1'], data['b'], embed_fn, vector_weight)
+        # 旧版本构建的索引中可能残留UTF-8 BOM
+        index.questions = [question.replace('\ufeff', '') for question in data['questions']]
+        index.answers = [answer.replace('\ufeff', '') for answer in data['answers']]
+        index.doc_lengths = data['doc_lengths']
+        index.total_length = sum(index.doc_lengths)
+        index.postings = {token: {int(k): v for k, v in docs.items()} for token, docs in data['postings'].items()}
+        index._question_ids = {question: i for i, question in enumerate(index.questions)}
+        if embed_fn is not None and index.questions:
+            vectors = [embed_fn(question) for question in index.questions]
+            index._vectors = np.stack(vectors).astype(np.float32)
+        return index
+
+
+def load_or_build_index(index_path, ids_path, faq_paths=(), embed_fn=None):
+    '''
+    加载持久化的索引；不存在时用source.txt/target.txt和FAQ文件构建并保存
+    index_path: 索引文件路径
+    ids_path: source.txt/target.txt所在目录
+    faq_paths: 额外的FAQ文件
+    '''
+    if os.path.exists(index_path):
+        return RetrievalIndex.load(index_path, embed_fn)
+
+    index = RetrievalIndex(embed_fn=embed_fn)
+    source_path = os.path.join(ids_path, 'source.txt')
+    target_path = os.path.join(ids_path, 'target.txt')
+    if os.path.exists(source_path) and os.path.exists(target_path):
+        index.add_pairs_from_ids(source_path, target_path)
+    for faq_path in faq_paths:
+        if os.path.exists(faq_path):
+            index.add_faq_file(faq_path)
+    index.save(index_path)
+    return index
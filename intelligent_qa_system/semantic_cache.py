@@ -0,0 +1,272 @@
+"""
+语义答案缓存
+对问题计算本地句向量，在内存向量索引中查找相似的已回答问题，
+相似度超过阈值且实词一致时直接返回已保存的答案，避免重复调用豆包API
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+
+# 参与比较的实词词性（jieba词性标注的前缀）：名词、动词、形容词、时间词、成语/习用语、英文
+CONTENT_FLAGS = ('n', 'v', 'a', 't', 'i', 'l', 'eng')
+# 不影响问题含义的常用词；疑问代词（什么/怎么/如何）只表示提问，同义问题中可以互换
+LIGHT_WORDS = frozenset(['是', '有', '在', '要', '会', '能', '想', '到', '请问', '知道', '告诉',
+                         '什么', '啥', '怎么', '怎样', '怎么样', '如何', '哪些', '哪个', '哪里', '哪儿', '谁', '多少'])
+# 否定词改变问题含义，也计入签名
+NEGATION_WORDS = frozenset(['不', '没', '没有', '别', '无', '非', '不是', '不能', '不会', '不要', '不可以'])
+NUMERAL_CHARS = frozenset('0123456789零一二两三四五六七八九十百千万亿')
+# 答案随时间变化的问题（相对时间、询问当前时间），不放入缓存
+TIME_SENSITIVE_WORDS = ('现在', '目前', '当前', '今天', '明天', '昨天', '今晚', '今年', '本周', '这周', '最近',
+                        '刚才', '几点', '几号', '星期几', '礼拜几', '周几', '日期', '时间')
+
+
+def content_signature(text):
+    '''
+    问题的实词签名：(实词集合, 按出现顺序排列的名词/英文/数字/人称和指示代词)
+    句向量是字和词的平均，对替换实体（北京/上海）、时间（明天/昨天）、人称（你/我）或交换顺序
+    （北京到上海/上海到北京、他喜欢我/我喜欢他）不敏感，两个问题的签名相同时才允许语义命中
+    '''
+    import jieba.posseg as pseg
+    words = set()
+    entities = []
+    for pair in pseg.cut(text):
+        word, flag = pair.word.strip().lower(), pair.flag
+        if not word or word in LIGHT_WORDS:
+            continue
+        if word in NEGATION_WORDS:
+            words.add(word)
+            continue
+        if flag == 'm' and any(c in NUMERAL_CHARS for c in word) and word not in ('一下', '一些', '一点'):
+            entities.append(word)
+        elif flag.startswith('r'):
+            entities.append(word)
+        elif flag.startswith(CONTENT_FLAGS):
+            words.add(word)
+            if flag.startswith(('n', 'eng')):
+                entities.append(word)
+    return frozenset(words), tuple(entities)
+
+
+def is_time_sensitive(text):
+    """问题的答案是否随时间变化（如“现在几点了”“明天天气怎么样”）"""
+    return any(word in text for word in TIME_SENSITIVE_WORDS)
+
+
+class SemanticCache:
+    """基于句向量余弦相似度的答案缓存（容量有上限，按LRU淘汰）"""
+
+    def __init__(self, embed_fn, capacity=1000, threshold=0.82, latency_window=1000, signature_fn=content_signature,
+                 ttl=None, skip_fn=is_time_sensitive):
+        '''
+        embed_fn: 文本 -> 归一化句向量
+        capacity: 最多缓存的问题数
+        threshold: 命中所需的最小余弦相似度
+        latency_window: 统计查询耗时时保留的最近样本数
+        signature_fn: 文本 -> 实词签名，签名不同的问题不会命中，为None时只比较相似度
+        ttl: 条目的有效期（秒），过期后不再命中，None表示不过期
+        skip_fn: 文本 -> 是否不缓存该问题（默认跳过答案随时间变化的问题），为None时全部缓存
+        '''
+        self.embed_fn = embed_fn
+        self.signature_fn = signature_fn
+        self.skip_fn = skip_fn
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=latency_window)
+        self.hits = 0
+        self.exact_hits = 0
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        """清空缓存（统计数据保留）"""
+        with self._lock:
+            self._reset(None)
+
+    def _reset(self, dim):
+        """按向量维度重新分配索引（调用方持有锁）"""
+        # 向量矩阵在第一次写入时按维度分配，之后原地复用
+        self._vectors = np.zeros((self.capacity, dim), dtype=np.float32) if dim else None
+        self._valid = np.zeros(self.capacity, dtype=bool)
+        self._stored_at = np.zeros(self.capacity, dtype=np.float64)
+        self._entries = [None] * self.capacity
+        self._signatures = [None] * self.capacity
+        self._exact = {}
+        self._lru = OrderedDict()
+        self._free = list(range(self.capacity - 1, -1, -1))
+
+    @staticmethod
+    def _normalize(question):
+        """精确匹配用的规范化问题"""
+        return ''.join(question.split()).lower()
+
+    def lookup(self, question):
+        '''
+        查找相似问题
+        返回 (命中结果或None, 问题向量)，向量可传给store避免重复计算
+        '''
+        start = time.perf_counter()
+        key = self._normalize(question)
+        vector = None
+        hit = None
+        with self._lock:
+            self._expire()
+            slot = self._exact.get(key)
+            if slot is not None:
+                hit = self._hit(slot, 1.0)
+                self.exact_hits += 1
+        if hit is None:
+            vector = self.embed_fn(question)
+            signature = self.signature_fn(question) if self.signature_fn else None
+            with self._lock:
+                self._expire()
+                if self._vectors is not None and vector.shape[0] == self._vectors.shape[1] and self._lru:
+                    scores = self._vectors @ vector
+                    scores[~self._valid] = -1.0
+                    # 从相似度最高的候选开始，取第一个实词签名相同的问题
+                    candidates = np.flatnonzero(scores >= self.threshold)
+                    for slot in candidates[np.argsort(-scores[candidates])]:
+                        if signature is None or self._signatures[slot] == signature:
+                            hit = self._hit(int(slot), float(scores[slot]))
+                            break
+        with self._lock:
+            if hit is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._latencies.append(time.perf_counter() - start)
+        return hit, vector
+
+    def _expire(self):
+        """移除过期条目（调用方持有锁）；LRU顺序最前的条目不一定最早写入，因此按写入时间检查全部条目"""
+        if self.ttl is None or not self._lru:
+            return
+        expired = np.flatnonzero(self._valid & (self._stored_at < time.time() - self.ttl))
+        for slot in expired.tolist():
+            self._remove(slot)
+
+    def _remove(self, slot):
+        """释放一个条目（调用方持有锁）"""
+        question, _ = self._entries[slot]
+        self._exact.pop(self._normalize(question), None)
+        self._lru.pop(slot, None)
+        self._valid[slot] = False
+        self._entries[slot] = None
+        self._signatures[slot] = None
+        self._free.append(slot)
+
+    def _hit(self, slot, similarity):
+        """记录命中并刷新LRU顺序（调用方持有锁）"""
+        self._lru.move_to_end(slot)
+        question, answer = self._entries[slot]
+        return {'question': question, 'answer': answer, 'similarity': similarity}
+
+    def store(self, question, answer, vector=None):
+        """保存问答对，缓存已满时淘汰最久未使用的条目"""
+        if self.skip_fn is not None and self.skip_fn(question):
+            return
+        if vector is None:
+            vector = self.embed_fn(question)
+        if not np.any(vector):
+            return
+        key = self._normalize(question)
+        signature = self.signature_fn(question) if self.signature_fn else None
+        with self._lock:
+            # 句向量维度变化（例如模型重新加载）时重建索引
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                self._reset(vector.shape[0])
+
+            slot = self._exact.get(key)
+            if slot is None:
+                if self._free:
+                    slot = self._free.pop()
+                else:
+                    slot, _ = self._lru.popitem(last=False)
+                    old_question, _ = self._entries[slot]
+                    self._exact.pop(self._normalize(old_question), None)
+            self._vectors[slot] = vector
+            self._valid[slot] = True
+            self._stored_at[slot] = time.time()
+            self._entries[slot] = (question, answer)
+            self._signatures[slot] = signature
+            self._exact[key] = slot
+            self._lru[slot] = None
+            self._lru.move_to_end(slot)
+
+    def stats(self):
+        """命中率和查询耗时报告"""
+        with self._lock:
+            total = self.hits + self.misses
+            latencies = np.array(self._latencies) * 1000 if self._latencies else np.zeros(1)
+            return {
+                'size': len(self._lru),
+                'capacity': self.capacity,
+                'threshold': self.threshold,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'exact_hits': self.exact_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'lookup_latency_ms': {
+                    'mean': float(latencies.mean()),
+                    'p50': float(np.percentile(latencies, 50)),
+                    'p95': float(np.percentile(latencies, 95)),
+                    'max': float(latencies.max())
+                }
+            }
+
+
+def load_labelled_pairs(path):
+    """读取标注的问题对（每行 `标签<TAB>问题1<TAB>问题2`，标签1表示同义、0表示不同义）"""
+    pairs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) == 3:
+                pairs.append((parts[0] == '1', parts[1], parts[2]))
+    return pairs
+
+
+def calibrate_threshold(embed_fn, pairs, signature_fn=content_signature, thresholds=None):
+    '''
+    在标注的问题对上选择相似度阈值
+    返回 (没有误命中时召回率最高的阈值（召回率相同时取较高的阈值）, 每个阈值的统计)，任何阈值都有误命中时阈值为None
+    '''
+    thresholds = thresholds if thresholds is not None else np.round(np.arange(0.5, 1.0, 0.02), 2)
+    scores = []
+    for same, a, b in pairs:
+        similarity = float(embed_fn(a) @ embed_fn(b))
+        matched = signature_fn is None or signature_fn(a) == signature_fn(b)
+        scores.append((same, similarity, matched))
+    positives = sum(1 for same, _, _ in scores if same)
+    report = []
+    best = None
+    for threshold in thresholds:
+        hits = [(same, similarity) for same, similarity, matched in scores if matched and similarity >= threshold]
+        true_hits = sum(1 for same, _ in hits if same)
+        false_hits = len(hits) - true_hits
+        recall = true_hits / positives if positives else 0.0
+        report.append({'threshold': float(threshold), 'true_hits': true_hits, 'false_hits': false_hits, 'recall': recall})
+        if false_hits == 0 and (best is None or recall >= best['recall']):
+            best = report[-1]
+    return (best['threshold'] if best else None), report
+
+
+if __name__ == '__main__':
+    # 用标注的问题对校准 app.py 中的 SEMANTIC_CACHE_THRESHOLD
+    from nlp_models import NLPModels
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    pairs = load_labelled_pairs(os.path.join(base_dir, 'data', 'semantic_cache_pairs.txt'))
+    models = NLPModels()
+    models.load_text_classifier()
+    for name, signature_fn in (('仅相似度', None), ('相似度 + 实词签名', content_signature)):
+        threshold, report = calibrate_threshold(models.embed_text, pairs, signature_fn)
+        print(f"{name}：建议阈值 {threshold}")
+        for row in report:
+            print(f"  阈值 {row['threshold']:.2f} 正确命中 {row['true_hits']} 误命中 {row['false_hits']} "
+                  f"召回率 {row['recall']:.0%}")
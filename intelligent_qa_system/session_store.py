@@ -0,0 +1,314 @@
+"""
+多轮对话会话存储
+按会话id保存最近若干轮对话（环形缓冲），超出token预算时把较早的轮次压缩为摘要，
+空闲会话按LRU/TTL淘汰；后端可选内存或本地SQLite
+
+运行 python session_store.py 可测量每1万个活跃会话的内存占用
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from text_utils import estimate_tokens
+
+
+class Session:
+    """单个会话：最近轮次 + 较早轮次的摘要"""
+
+    __slots__ = ('session_id', 'turns', 'summary', 'last_access')
+
+    def __init__(self, session_id, max_turns, turns=(), summary='', last_access=None):
+        self.session_id = session_id
+        # 每轮保存为 (role, content) 元组，比字典更紧凑
+        self.turns = deque(turns, maxlen=max_turns)
+        self.summary = summary
+        self.last_access = last_access or time.time()
+
+
+def compact_summary(summary, dropped_turns, max_chars=400, turn_chars=60):
+    '''
+    默认的本地摘要方法：把被移出的轮次截断后追加到摘要，摘要只保留最近的max_chars个字符
+    summary: 已有摘要
+    dropped_turns: 被移出上下文的 (role, content) 列表
+    '''
+    role_names = {'user': '用户', 'assistant': '助手'}
+    parts = [summary] if summary else []
+    for role, content in dropped_turns:
+        content = ' '.join(content.split())
+        if len(content) > turn_chars:
+            content = content[:turn_chars] + '…'
+        parts.append(f"{role_names.get(role, role)}：{content}")
+    text = '；'.join(parts)
+    return text[-max_chars:]
+
+
+class MemorySessionBackend:
+    """内存后端，OrderedDict按访问顺序排列，最久未访问的会话在最前面"""
+
+    def __init__(self):
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _touch(self, session_id, expire_before):
+        """取出未过期的会话，同时更新访问时间和LRU顺序（调用方持有锁）"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if session.last_access < expire_before:
+            del self._sessions[session_id]
+            return None
+        session.last_access = time.time()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def get(self, session_id, max_turns, expire_before):
+        with self._lock:
+            return self._touch(session_id, expire_before)
+
+    def update(self, session_id, max_turns, expire_before, modify):
+        """在同一把锁内读取（不存在或已过期时新建）、修改并保存会话"""
+        with self._lock:
+            session = self._touch(session_id, expire_before)
+            if session is None:
+                session = Session(session_id, max_turns)
+                self._sessions[session_id] = session
+            modify(session)
+            session.last_access = time.time()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def put(self, session):
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._sessions.move_to_end(session.session_id)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def evict(self, expire_before, max_sessions):
+        """淘汰过期会话和超出容量的最久未访问会话，返回淘汰数量"""
+        evicted = 0
+        with self._lock:
+            while self._sessions:
+                session_id, session = next(iter(self._sessions.items()))
+                if session.last_access >= expire_before and len(self._sessions) <= max_sessions:
+                    break
+                del self._sessions[session_id]
+                evicted += 1
+        return evicted
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionBackend:
+    """本地SQLite后端，会话在进程重启后仍然保留"""
+
+    def __init__(self, db_path='tmp/sessions.db'):
+        directory = os.path.dirname(db_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        # 自动提交模式，需要原子性的操作显式使用 BEGIN IMMEDIATE 事务
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'session_id TEXT PRIMARY KEY, summary TEXT, turns TEXT, last_access REAL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_last_access ON sessions(last_access)')
+
+    @contextmanager
+    def _transaction(self):
+        """写事务：BEGIN IMMEDIATE 立即取得写锁，多个进程共用数据库文件时读-改-写也不会丢失更新"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    @staticmethod
+    def _load(conn, session_id, max_turns, expire_before):
+        """读取未过期的会话，不存在或已过期时返回None"""
+        row = conn.execute(
+            'SELECT summary, turns, last_access FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+        if row is None or row[2] < expire_before:
+            return None
+        summary, turns, last_access = row
+        return Session(session_id, max_turns, [tuple(t) for t in json.loads(turns)], summary, last_access)
+
+    @staticmethod
+    def _save(conn, session):
+        conn.execute(
+            'INSERT OR REPLACE INTO sessions (session_id, summary, turns, last_access) VALUES (?, ?, ?, ?)',
+            (session.session_id, session.summary,
+             json.dumps(list(session.turns), ensure_ascii=False), session.last_access))
+
+    def get(self, session_id, max_turns, expire_before):
+        with self._transaction() as conn:
+            session = self._load(conn, session_id, max_turns, expire_before)
+            if session is not None:
+                session.last_access = time.time()
+                conn.execute('UPDATE sessions SET last_access = ? WHERE session_id = ?',
+                             (session.last_access, session_id))
+        return session
+
+    def update(self, session_id, max_turns, expire_before, modify):
+        """在同一个事务内读取（不存在或已过期时新建）、修改并保存会话"""
+        with self._transaction() as conn:
+            session = self._load(conn, session_id, max_turns, expire_before)
+            if session is None:
+                session = Session(session_id, max_turns)
+            modify(session)
+            session.last_access = time.time()
+            self._save(conn, session)
+        return session
+
+    def put(self, session):
+        with self._transaction() as conn:
+            self._save(conn, session)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+
+    def evict(self, expire_before, max_sessions):
+        """淘汰过期会话和超出容量的最久未访问会话，返回淘汰数量"""
+        with self._transaction() as conn:
+            evicted = conn.execute('DELETE FROM sessions WHERE last_access < ?', (expire_before,)).rowcount
+            evicted += conn.execute(
+                'DELETE FROM sessions WHERE session_id IN ('
+                'SELECT session_id FROM sessions ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+                (max_sessions,)).rowcount
+        return evicted
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+
+class SessionManager:
+    """会话管理：构造带上下文的消息列表、记录对话轮次、淘汰空闲会话"""
+
+    def __init__(self, backend=None, max_turns=20, token_budget=1500, ttl=1800,
+                 max_sessions=10000, summarize_fn=compact_summary, evict_interval=60):
+        '''
+        backend: 会话存储后端（默认内存）
+        max_turns: 每个会话保留的最近消息条数
+        token_budget: 历史消息（含摘要）的token上限
+        ttl: 会话空闲多少秒后过期
+        max_sessions: 最多保留的会话数
+        summarize_fn: (摘要, 被移出的轮次) -> 新摘要
+        evict_interval: 两次淘汰检查之间的最小间隔（秒）
+        '''
+        self.backend = backend if backend is not None else MemorySessionBackend()
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.summarize_fn = summarize_fn
+        self.evict_interval = evict_interval
+        self._last_evict = 0.0
+
+    def get_history(self, session_id):
+        '''
+        获取会话历史，返回可直接插入到对话请求中的消息列表
+        较早轮次的摘要以一条system消息的形式放在最前面
+        '''
+        session = self.backend.get(session_id, self.max_turns, time.time() - self.ttl)
+        if session is None:
+            return []
+        history = []
+        if session.summary:
+            history.append({'role': 'system', 'content': f'之前的对话摘要：{session.summary}'})
+        history.extend({'role': role, 'content': content} for role, content in session.turns)
+        return history
+
+    def append_turn(self, session_id, user_message, reply):
+        """记录一轮对话，并把超出条数或token预算的较早轮次压缩进摘要"""
+        def add_turn(session):
+            dropped = []
+            for turn in (('user', user_message), ('assistant', reply)):
+                if len(session.turns) == session.turns.maxlen:
+                    dropped.append(session.turns.popleft())
+                session.turns.append(turn)
+
+            turn_tokens = sum(estimate_tokens(c) for _, c in session.turns)
+            # 至少保留最近一轮（两条消息）
+            while estimate_tokens(session.summary) + turn_tokens > self.token_budget and len(session.turns) > 2:
+                turn = session.turns.popleft()
+                dropped.append(turn)
+                turn_tokens -= estimate_tokens(turn[1])
+            if dropped:
+                session.summary = self.summarize_fn(session.summary, dropped)
+
+            # 新摘要比旧摘要长，按新摘要重新计算，超出预算时继续把较早的轮次移入摘要
+            while estimate_tokens(session.summary) + turn_tokens > self.token_budget and len(session.turns) > 2:
+                turn = session.turns.popleft()
+                turn_tokens -= estimate_tokens(turn[1])
+                session.summary = self.summarize_fn(session.summary, [turn])
+            # 只剩最近一轮时截掉摘要较早的部分
+            while session.summary and estimate_tokens(session.summary) + turn_tokens > self.token_budget:
+                excess = estimate_tokens(session.summary) + turn_tokens - self.token_budget
+                session.summary = session.summary[max(1, excess):]
+
+        # 读取、修改、保存在后端的同一个锁/事务内完成，同一会话的并发请求不会互相覆盖
+        self.backend.update(session_id, self.max_turns, time.time() - self.ttl, add_turn)
+        self.evict_idle()
+
+    def reset(self, session_id):
+        """清空会话"""
+        self.backend.delete(session_id)
+
+    def evict_idle(self, force=False):
+        """按TTL和容量淘汰空闲会话（默认最多每evict_interval秒执行一次）"""
+        now = time.time()
+        if not force and now - self._last_evict < self.evict_interval and len(self.backend) <= self.max_sessions:
+            return 0
+        self._last_evict = now
+        return self.backend.evict(now - self.ttl, self.max_sessions)
+
+    def stats(self):
+        """活跃会话数"""
+        return {
+            'active_sessions': len(self.backend),
+            'max_sessions': self.max_sessions,
+            'max_turns': self.max_turns,
+            'token_budget': self.token_budget,
+            'ttl': self.ttl
+        }
+
+
+def measure_memory(num_sessions=10000, turns_per_session=5, message='你好，请问这件衣服还有货吗？我想要一件中号的。'):
+    """测量内存后端保存num_sessions个会话（每个会话turns_per_session轮对话）占用的内存"""
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    manager = SessionManager(MemorySessionBackend(), max_sessions=num_sessions)
+    for i in range(num_sessions):
+        for _ in range(turns_per_session):
+            manager.append_turn(f'session-{i}', f'{message}{i}', f'{message}{i}')
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'sessions': num_sessions,
+        'turns_per_session': turns_per_session,
+        'bytes': after - before,
+        'bytes_per_session': (after - before) / num_sessions,
+        'peak_bytes': peak - before
+    }
+
+
+if __name__ == '__main__':
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    report = measure_memory(num)
+    print(f"{report['sessions']} 个会话（每个 {report['turns_per_session']} 轮）占用内存 "
+          f"{report['bytes'] / 1024 / 1024:.2f} MB，平均每个会话 {report['bytes_per_session']:.0f} 字节")
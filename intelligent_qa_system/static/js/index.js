@@ -1,6 +1,8 @@
 // 全局变量
 let isLoading = false;
 let lastMessageTime = null;
+// 当前会话id（页面刷新后开始新的会话）
+const conversationId = Date.now().toString(36) + Math.random().toString(36).slice(2, 10);
 
 // DOM 元素
 const $messagesContainer = $('#messagesContainer');
@@ -67,7 +69,7 @@ function sendMessage() {
     $.ajax({
         url: '/message',
         method: 'POST',
-        data: { msg: message },
+        data: { msg: message, conversation_id: conversationId },
         timeout: 30000
     })
     .done(function(response) {
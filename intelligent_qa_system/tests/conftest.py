@@ -0,0 +1,24 @@
+"""
+测试公共配置：项目模块按扁平结构导入，数据和模型文件按项目目录下的相对路径读取
+"""
+import os
+import sys
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+os.chdir(PROJECT_DIR)
+
+
+@pytest.fixture(scope='session')
+def qa_app():
+    """导入Flask应用（加载模型和检索索引，整个测试会话只导入一次）"""
+    import app
+    app.app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def client(qa_app):
+    return qa_app.app.test_client()
@@ -0,0 +1,48 @@
+"""
+管理接口的访问控制：未配置 QA_ADMIN_TOKEN 时一律拒绝
+"""
+from retrieval import RetrievalIndex
+
+
+def test_retrieval_add_rejected_without_token(qa_app, client, monkeypatch):
+    monkeypatch.setattr(qa_app, 'ADMIN_TOKEN', '')
+    size = len(qa_app.retrieval_index)
+    response = client.post('/retrieval/add', data={'question': '你好，在吗', 'answer': 'HACKED'})
+    assert response.status_code == 403
+    assert len(qa_app.retrieval_index) == size
+
+
+def test_retrieval_add_rejected_with_wrong_token(qa_app, client, monkeypatch):
+    monkeypatch.setattr(qa_app, 'ADMIN_TOKEN', 'secret')
+    size = len(qa_app.retrieval_index)
+    for headers in ({}, {'X-Admin-Token': ''}, {'X-Admin-Token': 'wrong'}):
+        response = client.post('/retrieval/add', data={'question': '你好，在吗', 'answer': 'HACKED'},
+                               headers=headers)
+        assert response.status_code == 403
+    assert len(qa_app.retrieval_index) == size
+
+
+def test_retrieval_add_accepted_with_token(qa_app, client, monkeypatch, tmp_path):
+    monkeypatch.setattr(qa_app, 'ADMIN_TOKEN', 'secret')
+    monkeypatch.setattr(qa_app, 'RETRIEVAL_INDEX_PATH', str(tmp_path / 'index.json'))
+    monkeypatch.setattr(qa_app, 'retrieval_index', RetrievalIndex())
+    response = client.post('/retrieval/add', data={'question': '测试问题', 'answer': '测试答案'},
+                           headers={'X-Admin-Token': 'secret'})
+    assert response.status_code == 200
+    assert response.get_json()['size'] == 1
+    assert (tmp_path / 'index.json').exists()
+
+
+def test_admin_models_rejected_without_token(qa_app, client, monkeypatch):
+    monkeypatch.setattr(qa_app, 'ADMIN_TOKEN', '')
+    assert client.get('/admin/models').status_code == 403
+    assert client.post('/admin/models/text_classifier/reload').status_code == 403
+    assert client.post('/admin/models/text_classifier/reload', headers={'X-Admin-Token': ''}).status_code == 403
+
+
+def test_admin_models_with_token(qa_app, client, monkeypatch):
+    monkeypatch.setattr(qa_app, 'ADMIN_TOKEN', 'secret')
+    response = client.get('/admin/models', headers={'X-Admin-Token': 'secret'})
+    assert response.status_code == 200
+    assert 'text_classifier' in response.get_json()
+
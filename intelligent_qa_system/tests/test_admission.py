@@ -0,0 +1,46 @@
+"""
+准入控制：因排队已满被拒绝的请求不消耗客户端的限流令牌
+"""
+import uuid
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, MemoryBucketBackend, SharedMemoryBucketBackend
+
+
+@pytest.fixture(params=['memory', 'shared'])
+def backend(request):
+    if request.param == 'memory':
+        yield MemoryBucketBackend()
+        return
+    shared = SharedMemoryBucketBackend(name=f'qa_test_{uuid.uuid4().hex[:8]}', slots=64)
+    yield shared
+    shared.unlink()
+    shared.close()
+
+
+def test_queue_full_refunds_tokens(backend):
+    controller = AdmissionController(1, {'interactive': 0, 'bulk': 0}, 1.0, {'interactive': (0.001, 3)}, backend)
+    controller.admit('client', 'interactive')
+    # 名额已满且不允许排队：每次都被拒绝，但令牌被退还
+    for _ in range(10):
+        with pytest.raises(AdmissionRejected) as e:
+            controller.admit('client', 'interactive')
+        assert e.value.reason == 'queue_full'
+    controller.release()
+    # 第一次请求用掉1个令牌，还剩2个
+    controller.admit('client', 'interactive')
+    controller.release()
+    controller.admit('client', 'interactive')
+    controller.release()
+    with pytest.raises(AdmissionRejected) as e:
+        controller.admit('client', 'interactive')
+    assert e.value.reason == 'rate_limited'
+
+
+def test_admission_stats_requires_token(qa_app, client, monkeypatch):
+    monkeypatch.setattr(qa_app, 'ADMIN_TOKEN', '')
+    assert client.get('/admission/stats').status_code == 403
+    monkeypatch.setattr(qa_app, 'ADMIN_TOKEN', 'secret')
+    assert client.get('/admission/stats').status_code == 403
+    assert client.get('/admission/stats', headers={'X-Admin-Token': 'secret'}).status_code == 200
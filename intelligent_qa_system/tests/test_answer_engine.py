@@ -0,0 +1,49 @@
+"""
+分级问答：多轮对话中不依赖上文的问题仍由本地各级回答，依赖上文的追问带着历史对话转交豆包API
+"""
+import uuid
+
+import pytest
+
+from answer_engine import is_context_dependent
+
+
+@pytest.fixture
+def remote_calls(qa_app, monkeypatch):
+    calls = []
+
+    def chat(question, history=None):
+        calls.append((question, list(history or [])))
+        return {'success': True, 'reply': '远程回答'}
+
+    monkeypatch.setattr(qa_app.doubao, 'chat', chat)
+    return calls
+
+
+@pytest.mark.parametrize('question', ['为什么', '然后呢', '上海呢？', '那北京呢', '它多大了', '能详细说说吗'])
+def test_follow_ups_depend_on_context(question):
+    assert is_context_dependent(question)
+
+
+@pytest.mark.parametrize('question', ['什么是人工智能', '你好，在吗', '这件衣服有货吗', '昨晚你睡得好吗？'])
+def test_standalone_questions(question):
+    assert not is_context_dependent(question)
+
+
+def test_second_turn_answered_locally(qa_app, client, remote_calls):
+    if qa_app.retrieval_index is None:
+        pytest.skip('问答检索索引不可用')
+    conversation_id = uuid.uuid4().hex
+    sources = []
+    for message in ('你好，在吗', '这件衣服有货吗', '为什么'):
+        response = client.post('/message', data={'msg': message, 'conversation_id': conversation_id})
+        assert response.status_code == 200
+        sources.append(response.get_json()['source'])
+
+    assert sources[:2] == ['retrieval', 'retrieval']
+    # 只有依赖上文的追问调用了豆包API，并带上了前两轮对话
+    assert sources[2] == 'remote'
+    assert len(remote_calls) == 1
+    question, history = remote_calls[0]
+    assert question == '为什么'
+    assert [turn['content'] for turn in history if turn['role'] == 'user'] == ['你好，在吗', '这件衣服有货吗']
@@ -0,0 +1,57 @@
+"""
+模型注册表：只监视启用的模型，版本更新时通知依赖方
+"""
+import os
+
+from nlp_models import ModelRegistry
+
+
+def _registry(tmp_path, loaded):
+    registry = ModelRegistry()
+    for name in ('enabled', 'disabled'):
+        path = tmp_path / f'{name}.bin'
+        path.write_text('v1')
+        registry.register(name, lambda name=name: loaded.append(name) or name,
+                          lambda path=path: [str(path)])
+    return registry
+
+
+def _touch(path):
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+
+
+def test_watcher_skips_models_never_loaded(tmp_path):
+    loaded = []
+    registry = _registry(tmp_path, loaded)
+    assert registry.load('enabled')
+    assert registry.check_for_updates() == []
+
+    _touch(tmp_path / 'enabled.bin')
+    _touch(tmp_path / 'disabled.bin')
+    assert registry.check_for_updates() == ['enabled']
+    assert 'disabled' not in loaded
+    assert registry.get('disabled') is None
+
+
+def test_update_callbacks_receive_new_versions(tmp_path):
+    registry = _registry(tmp_path, [])
+    versions = []
+    registry.on_update('enabled', versions.append)
+    registry.on_update('enabled', lambda version: 1 / 0)  # 回调出错不影响模型替换
+    assert registry.load('enabled')
+    assert registry.load('enabled')
+    assert registry.reload('enabled', wait=True)
+    assert versions == [1, 2, 3]
+    assert registry.info('enabled')['enabled']['version'] == 3
+
+
+def test_text_classifier_update_invalidates_vectors(qa_app, monkeypatch):
+    calls = []
+    monkeypatch.setattr(qa_app.semantic_cache, 'clear', lambda: calls.append('cache'))
+    if qa_app.retrieval_index is not None:
+        monkeypatch.setattr(qa_app.retrieval_index, 'rebuild_vectors', lambda: calls.append('retrieval'))
+    classifier = qa_app.nlp_models.registry.get('text_classifier')
+    qa_app.nlp_models.registry.install('text_classifier', classifier)
+    assert 'cache' in calls
+    assert qa_app.retrieval_index is None or 'retrieval' in calls
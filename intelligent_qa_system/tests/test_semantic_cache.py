@@ -0,0 +1,56 @@
+"""
+语义缓存：替换时间、人称或交换人称顺序的问题不能命中，答案随时间变化的问题不缓存
+"""
+import time
+
+import pytest
+
+from nlp_models import NLPModels
+from semantic_cache import SemanticCache, content_signature, is_time_sensitive
+
+THRESHOLD = 0.56
+
+
+@pytest.fixture(scope='module')
+def embed_fn():
+    return NLPModels().embed_text
+
+
+@pytest.mark.parametrize('cached, asked', [
+    ('北京明天天气怎么样', '北京昨天天气怎么样'),
+    ('今天星期几', '明天星期几'),
+    ('上午开会吗', '下午开会吗'),
+    ('你是谁', '我是谁'),
+    ('你多大了', '我多大了'),
+    ('他喜欢我吗', '我喜欢他吗'),
+])
+def test_different_questions_miss(embed_fn, cached, asked):
+    assert content_signature(cached) != content_signature(asked)
+    cache = SemanticCache(embed_fn, 10, THRESHOLD, skip_fn=None)
+    cache.store(cached, 'answer')
+    hit, _ = cache.lookup(asked)
+    assert hit is None
+
+
+def test_paraphrase_hits(embed_fn):
+    cache = SemanticCache(embed_fn, 10, THRESHOLD)
+    cache.store('猫可以吃巧克力吗', 'answer')
+    hit, _ = cache.lookup('猫能吃巧克力吗？')
+    assert hit is not None and hit['answer'] == 'answer'
+
+
+def test_time_sensitive_questions_not_cached(embed_fn):
+    assert is_time_sensitive('现在几点了')
+    cache = SemanticCache(embed_fn, 10, THRESHOLD)
+    cache.store('现在几点了', '10点')
+    assert cache.lookup('现在几点了')[0] is None
+    assert cache.stats()['size'] == 0
+
+
+def test_entries_expire(embed_fn):
+    cache = SemanticCache(embed_fn, 10, THRESHOLD, ttl=0.1)
+    cache.store('猫可以吃巧克力吗', 'answer')
+    assert cache.lookup('猫可以吃巧克力吗')[0] is not None
+    time.sleep(0.2)
+    assert cache.lookup('猫可以吃巧克力吗')[0] is None
+    assert cache.stats()['size'] == 0
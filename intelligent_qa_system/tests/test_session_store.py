@@ -0,0 +1,37 @@
+"""
+会话存储：历史（含摘要）不超过token预算
+"""
+from session_store import SessionManager, MemorySessionBackend, compact_summary
+from text_utils import estimate_tokens
+
+
+def _history_tokens(manager, session_id):
+    return sum(estimate_tokens(message['content']) for message in manager.get_history(session_id))
+
+
+def test_history_within_budget_after_summary_grows():
+    budget = 120
+    manager = SessionManager(MemorySessionBackend(), max_turns=20, token_budget=budget)
+    for i in range(30):
+        manager.append_turn('s', f'第{i}个问题：' + '请详细介绍一下这个产品的功能' * 2, f'第{i}个回答：' + '这个产品有很多功能' * 3)
+        session = manager.backend.get('s', manager.max_turns, 0)
+        tokens = estimate_tokens(session.summary) + sum(estimate_tokens(c) for _, c in session.turns)
+        assert tokens <= budget
+        assert len(session.turns) >= 2
+    assert manager.get_history('s')[0]['role'] == 'system'
+
+
+def test_summary_trimmed_when_only_last_turn_left():
+    manager = SessionManager(MemorySessionBackend(), token_budget=60,
+                             summarize_fn=lambda summary, dropped: compact_summary(summary, dropped, max_chars=400))
+    for i in range(5):
+        manager.append_turn('s', '问' * 25, '答' * 25)
+    session = manager.backend.get('s', manager.max_turns, 0)
+    assert len(session.turns) == 2
+    assert estimate_tokens(session.summary) + 50 <= 60
+
+
+def test_session_stats_route(client):
+    response = client.get('/session/stats')
+    assert response.status_code == 200
+    assert {'active_sessions', 'max_sessions', 'token_budget'} <= set(response.get_json())
@@ -0,0 +1,18 @@
+"""
+文本处理的公共工具
+token估算供批量翻译切分片段和会话历史控制token预算共用
+"""
+import re
+
+
+# 中文字符
+CJK_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+# 非中文的词和符号
+WORD_PATTERN = re.compile(r'[A-Za-z0-9]+|[^\sA-Za-z0-9\u4e00-\u9fff]')
+
+
+def estimate_tokens(text):
+    """粗略估算文本的token数（中文按字计，英文按词计）"""
+    cjk_count = len(CJK_PATTERN.findall(text))
+    word_count = len(WORD_PATTERN.findall(text))
+    return cjk_count + int(word_count * 1.3)
@@ -0,0 +1,149 @@
+'''
+对话词典
+预处理、训练和推理共用的词典：id -> 词用数组保存，词 -> id用哈希表索引，
+0-3号id保留给特殊标记，支持基于NumPy数组的批量编码和解码
+'''
+
+import os
+from collections import Counter
+
+import numpy as np
+
+# 特殊标记及其固定的id
+SPECIAL_TOKENS = ('_BOS', '_EOS', '_PAD', '_UNK')
+BOS_ID, EOS_ID, PAD_ID, UNK_ID = range(len(SPECIAL_TOKENS))
+SPECIAL_TOKEN_IDS = {token: i for i, token in enumerate(SPECIAL_TOKENS)}
+
+
+class Vocab:
+    """词典：特殊标记在前（id 0-3），普通词从4开始编号"""
+
+    def __init__(self, tokens=()):
+        '''
+        tokens: 普通词列表（按id顺序），与特殊标记重复的词会被忽略
+        '''
+        words = [t for t in dict.fromkeys(tokens) if t not in SPECIAL_TOKEN_IDS]
+        # id -> 词
+        self._tokens = np.array(list(SPECIAL_TOKENS) + words, dtype=object)
+        # 词 -> id
+        self._ids = {token: i for i, token in enumerate(self._tokens)}
+        self._is_special = np.zeros(len(self._tokens), dtype=bool)
+        self._is_special[:len(SPECIAL_TOKENS)] = True
+
+    @classmethod
+    def from_corpus(cls, corpus_cut, min_count=1):
+        '''
+        由分词后的语料构建词典
+        词按出现次数降序排列，次数相同时按首次出现的顺序排列，保证每次构建的id一致
+        corpus_cut: 分词后的语料
+        min_count: 词的最少出现次数
+        '''
+        counts = Counter()
+        for words in corpus_cut:
+            counts.update(words)
+        # Counter按首次出现的顺序保存，sorted是稳定排序
+        tokens = sorted(counts, key=lambda token: -counts[token])
+        return cls(t for t in tokens if counts[t] >= min_count)
+
+    @classmethod
+    def load(cls, path):
+        """从词典文件（all_dict.txt，每行一个普通词，第i行的id为i+4）加载"""
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        # 只按换行切分，保留由空白组成的词，与tf.lookup.TextFileInitializer按整行读取的结果一致
+        if lines and lines[-1] == '':
+            lines.pop()
+        return cls(lines)
+
+    def save(self, path):
+        """保存为词典文件（只保存普通词）"""
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(token + '\n' for token in self._tokens[len(SPECIAL_TOKENS):])
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def __contains__(self, token):
+        return token in self._ids
+
+    @property
+    def tokens(self):
+        """普通词列表（按id顺序）"""
+        return self._tokens[len(SPECIAL_TOKENS):].tolist()
+
+    def token_to_id(self, token):
+        return self._ids.get(token, UNK_ID)
+
+    def id_to_token(self, token_id):
+        return self._tokens[token_id] if 0 <= token_id < len(self._tokens) else SPECIAL_TOKENS[UNK_ID]
+
+    def encode(self, tokens, add_bos_eos=False):
+        """把词序列转为id数组"""
+        ids = [self._ids.get(token, UNK_ID) for token in tokens]
+        if add_bos_eos:
+            ids = [BOS_ID] + ids + [EOS_ID]
+        return np.array(ids, dtype=np.int32)
+
+    def encode_batch(self, sequences, max_length=None, add_bos_eos=False):
+        '''
+        批量编码
+        sequences: 词序列的列表
+        max_length: 输出的列数（含开始和结束标记），超出的部分截断，为None时取最长序列的长度
+        返回 (形状为[批次大小, max_length]、用_PAD补齐的int32数组, 每个序列的实际长度)
+        '''
+        extra = 2 if add_bos_eos else 0
+        lengths = np.array([len(s) + extra for s in sequences], dtype=np.int32)
+        if max_length is None:
+            max_length = int(lengths.max()) if len(sequences) else 0
+        np.minimum(lengths, max_length, out=lengths)
+        ids = np.full((len(sequences), max_length), PAD_ID, dtype=np.int32)
+        get = self._ids.get
+        for row, tokens in enumerate(sequences):
+            if add_bos_eos:
+                # 截断时保留结束标记
+                body = max(0, min(len(tokens), max_length - 2))
+                ids[row, 0] = BOS_ID
+                ids[row, 1:body + 1] = [get(token, UNK_ID) for token in tokens[:body]]
+                if body + 1 < max_length:
+                    ids[row, body + 1] = EOS_ID
+            else:
+                ids[row, :lengths[row]] = [get(token, UNK_ID) for token in tokens[:max_length]]
+        return ids, lengths
+
+    def decode(self, ids, stop_at_eos=True, skip_special=True):
+        '''
+        把id序列转为词列表
+        stop_at_eos: 遇到结束标记时停止
+        skip_special: 去掉特殊标记（_UNK除外）
+        '''
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        if stop_at_eos:
+            eos = np.flatnonzero(ids == EOS_ID)
+            if eos.size:
+                ids = ids[:eos[0]]
+        # 越界的id按_UNK处理
+        ids = np.where((ids >= 0) & (ids < len(self._tokens)), ids, UNK_ID)
+        if skip_special:
+            ids = ids[~self._is_special[ids] | (ids == UNK_ID)]
+        return self._tokens[ids].tolist()
+
+    def decode_batch(self, ids, stop_at_eos=True, skip_special=True):
+        """批量解码二维id数组"""
+        return [self.decode(row, stop_at_eos, skip_special) for row in np.asarray(ids)]
+
+    def unk_ratio(self, ids):
+        """id序列中_UNK所占的比例"""
+        ids = np.asarray(ids).reshape(-1)
+        return float(np.mean(ids == UNK_ID)) if ids.size else 0.0
+
+    def as_tf_table(self):
+        """转为TensorFlow哈希表（词 -> id，未登录词映射为_UNK），供tf.data管道使用"""
+        import tensorflow as tf
+        return tf.lookup.StaticHashTable(
+            tf.lookup.KeyValueTensorInitializer(
+                tf.constant(self._tokens.tolist(), dtype=tf.string),
+                tf.range(len(self._tokens), dtype=tf.int64)),
+            default_value=UNK_ID)